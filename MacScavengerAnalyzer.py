@@ -1,116 +1,283 @@
-import json
-from collections import defaultdict
-from hashlib import sha1
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Full, Queue
+from threading import RLock, Thread
 
+import numpy as np
 import pandas as pd
 from streamz import Stream, glob
 
+from MacScavengerCaptureFormat import CAPTURE_EXTENSION, iter_capture_chunks
 from MacScavengerDataBase import MacScavengerDataBase
+from MacScavengerIngest import RECORD_KEYS, is_record_valid, iter_record_chunks
 from MacScavengerLocalizer import MacScavengerLocalizer
+from MacScavengerMetrics import PipelineMetrics
+from MacScavengerWindowing import IntervalWindower
 
+IntervalMeasurements = namedtuple('IntervalMeasurements', ['keys', 'aps', 'rssi', 'running_median'])
+
+worker_localizer = None
+
+
+def init_localization_worker(localizer):
+    global worker_localizer
+    worker_localizer = localizer
+
+
+def localize_in_worker(aps, rssi, seeds, x0s):
+    return worker_localizer.locate_matrix(aps, rssi, seeds, x0s)
 
 
 class ScavengerAnalyzer:
-    def __init__(self, ap_data, time_interval_in_s=10, assumed_walking_speed_km_per_h=2, in_burst_threshold_in_s=1, min_device_detection_rate=3, verbosity=0):
-        self.Localizer = MacScavengerLocalizer(ap_data)
-        self.database = MacScavengerDataBase()
+    def __init__(self, ap_data, time_interval_in_s=10, assumed_walking_speed_km_per_h=2, in_burst_threshold_in_s=1, min_device_detection_rate=3, verbosity=0, workers=1, backend='memory', snapshot_path=None, records_per_chunk=50000, allowed_lateness_in_s=10, multistart='fixed', seed=None, profile=False):
+        self.Localizer = MacScavengerLocalizer(ap_data, seed)
+        self.Localizer.multistart = multistart
+        self.last_locations = OrderedDict()
+        self.max_last_locations = 100000
+        self.database = MacScavengerDataBase(backend)
+        self.snapshot_path = snapshot_path
+        self.records_per_chunk = records_per_chunk
         self.time_interval_in_s = time_interval_in_s
+        self.allowed_lateness_in_s = allowed_lateness_in_s
+        self.windower = None
         self.assumed_walking_speed_km_per_h = assumed_walking_speed_km_per_h
         self.running_median = None
         self.in_burst_threshold_in_s = in_burst_threshold_in_s
         self.min_device_detection_rate = min_device_detection_rate
         self.verbosity = verbosity
-
+        self.workers = workers
+        self.pool = None
+        self.pending_localizations = deque()
+        self.metrics = PipelineMetrics() if profile else None
+        self.lock = RLock()
+        self.live_queue = None
+        self.live_thread = None
+        self.live_error = None
+        self.latest_stored_interval = None
 
     def get_config(self):
-        return self.time_interval_in_s, self.assumed_walking_speed_km_per_h, self.in_burst_threshold_in_s, self.min_device_detection_rate, self.verbosity
+        return self.time_interval_in_s, self.assumed_walking_speed_km_per_h, self.in_burst_threshold_in_s, self.min_device_detection_rate, self.verbosity, self.workers, self.Localizer.multistart
 
     def print(self, text):
         if self.verbosity == 1:
             print(text)
 
-    def start(self, data_path, is_dir):
+    def _grouping_stream(self):
+        self.windower = IntervalWindower(self.time_interval_in_s, self.allowed_lateness_in_s)
         source = Stream()
-        pipe = source \
-            .map(self._load_json) \
-            .map(pd.DataFrame) \
-            .map(self._parse_timestamp) \
-            .accumulate(self._create_even_intervals, returns_state=True, start=pd.DataFrame()) \
-            .flatten() \
-            .map(self._create_hash) \
-            .map(self._intersect_overlapping) \
+        records = source \
+            .map(self._stage('load', self._load_records)) \
+            .flatten()
+        split = records \
+            .map(self._stage('parse timestamp', self._parse_timestamp)) \
+            .map(self._stage('interval split', self.windower.push, {'open windows': lambda: len(self.windower.open_windows),
+                                                                     'late records': lambda: self.windower.late_records})) \
+            .flatten()
+        grouped = split \
+            .map(self._stage('hash', self._create_hash)) \
+            .map(self._stage('intersect', self._intersect_overlapping)) \
             .filter(lambda x: x is not None and len(x) > 0) \
-            .map(self._group_ies_and_ssids) \
-            .map(self._localize) \
-            .map(self._interpret_results) \
-            .sink(self._to_database)
+            .map(self._stage('group', self._group_ies_and_ssids))
+        return source, records, split, grouped
+
+    def _analysis_stream(self, grouped):
+        localized = None
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_localization_worker, initargs=(self.Localizer,))
+            localized = grouped.map(self._stage('localize', self._submit_localization, {'pending localizations': lambda: len(self.pending_localizations)})).flatten()
+            interval = localized.map(self._restore_interval)
+        else:
+            interval = grouped.map(self._stage('localize', self._localize))
+        interval \
+            .map(self._stage('interpret', self._interpret_results)) \
+            .sink(self._stage('store', self._to_database))
+        return localized
+
+    def _stage(self, name, function, gauges=None):
+        if self.metrics is None:
+            return function
+        return self.metrics.wrap(name, function, gauges)
+
+    def _emit_files(self, source, data_path, is_dir):
         if is_dir:
-            for fn in glob(data_path+'/*.json'):
+            for fn in sorted(glob(data_path+'/*.json') + glob(data_path+'/*'+CAPTURE_EXTENSION)):
                 source.emit(fn)
         else:
             for fn in glob(data_path):
                 source.emit(fn)
 
-    def _load_json(self, path):
-        with open(path, 'r') as inp_:
-            return json.load(inp_)
+    def _drain(self, split, localized):
+        for window in self._stage('interval split', lambda _: self.windower.flush())(None):
+            split.emit(window)
+        if self.pool:
+            for localized_interval in self._collect_localizations(0):
+                localized.emit(localized_interval)
+
+    def _shutdown_pool(self):
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+            self.pending_localizations.clear()
+
+    def start(self, data_path, is_dir):
+        source, _, split, grouped = self._grouping_stream()
+        localized = self._analysis_stream(grouped)
+        try:
+            self._emit_files(source, data_path, is_dir)
+            self._drain(split, localized)
+            if self.snapshot_path:
+                self.database.snapshot(self.snapshot_path)
+        finally:
+            self._shutdown_pool()
+
+    def start_live(self, queue_size=64, idle_timeout_in_s=1):
+        _, records, split, grouped = self._grouping_stream()
+        localized = self._analysis_stream(grouped)
+        self.live_queue = Queue(maxsize=queue_size)
+        self.live_error = None
+        self.live_thread = Thread(target=self._consume_live, args=(records, split, localized, idle_timeout_in_s), daemon=True)
+        self.live_thread.start()
+
+    def feed(self, records):
+        while self.live_thread.is_alive():
+            try:
+                self.live_queue.put(records, timeout=1)
+                return
+            except Full:
+                continue
+
+    def stop_live(self):
+        self.feed(None)
+        self.live_thread.join()
+        if self.snapshot_path and self.live_error is None:
+            self.database.snapshot(self.snapshot_path)
+        if self.live_error is not None:
+            raise self.live_error
+
+    def _consume_live(self, records, split, localized, idle_timeout_in_s):
+        try:
+            while True:
+                try:
+                    batch = self.live_queue.get(timeout=idle_timeout_in_s)
+                except Empty:
+                    with self.lock:
+                        for window in self.windower.advance(time.time_ns() - int(self.allowed_lateness_in_s * 1e9)):
+                            split.emit(window)
+                        if self.pool:
+                            for localized_interval in self._collect_localizations(2 * self.workers):
+                                localized.emit(localized_interval)
+                    continue
+                if batch is None:
+                    break
+                with self.lock:
+                    records.emit(pd.DataFrame([record for record in batch if is_record_valid(record)], columns=RECORD_KEYS))
+            with self.lock:
+                self._drain(split, localized)
+        except Exception as e:
+            self.live_error = e
+        finally:
+            self._shutdown_pool()
+
+    def live_status(self):
+        with self.lock:
+            counts = self.summary_counts()
+        latest = None if self.latest_stored_interval is None else time.time() - self.latest_stored_interval / 1e9
+        return counts, self.live_queue.qsize(), latest, self.late_records()
+
+    def late_records(self):
+        return self.windower.late_records if self.windower else 0
+
+    def _load_records(self, path):
+        if path.endswith(CAPTURE_EXTENSION):
+            return iter_capture_chunks(path, self.records_per_chunk)
+        return iter_record_chunks(path, self.records_per_chunk)
 
     def _parse_timestamp(self, data_frame):
         data_frame['epoch'] = pd.to_datetime(data_frame.epoch.astype(int), unit='ns')
         return data_frame
 
-    def _create_even_intervals(self, state, data_frame):
-        new_data_frame = state.append(data_frame)
-        intervals = (new_data_frame.epoch - new_data_frame.epoch[0]).astype('timedelta64[{}s]'.format(self.time_interval_in_s))
-        split_data_frame = [g.reset_index(drop=True) for i, g in new_data_frame.groupby([intervals])]
-        if len(split_data_frame) > 1:
-            return pd.DataFrame(), split_data_frame
-        else:
-            return new_data_frame, []
-
     def _create_hash(self, data_frame):
-        data_frame['hash'] = data_frame['ie'] + data_frame['ssid']
-        data_frame['hash'] = data_frame['hash'].apply(lambda x: sha1(str(x).encode('utf-8')).hexdigest())
+        data_frame['hash'] = pd.util.hash_pandas_object(data_frame[['ie', 'ssid']], index=False).values
         return data_frame
 
     def _intersect_overlapping(self, data_frame):
-        distinct_devices = list(data_frame.ap.unique())
-        dfs = [data_frame[data_frame['ap'] == ap] for ap in distinct_devices]
-        if len(dfs) >= self.min_device_detection_rate:
-            intersect_hash = set(dfs[0]['hash']).intersection(*[set(df['hash']) for df in dfs[1:]])
-            intersect_dfs = [df[df['hash'].isin(intersect_hash)] for df in dfs]
-            intersect_dfs_list = [intersect_df.drop('hash', axis=1) for intersect_df in intersect_dfs]
-            new_df = pd.concat(intersect_dfs_list)
-            if len(new_df) > 0:
-                return new_df
-            else:
-                return None
+        detection_rate = data_frame.groupby('hash', sort=False)['ap'].nunique()
+        overlapping = detection_rate.index[detection_rate >= self.min_device_detection_rate]
+        new_df = data_frame[data_frame['hash'].isin(overlapping)].drop('hash', axis=1)
+        if len(new_df) > 0:
+            return new_df
         else:
             return None
 
     def _group_ies_and_ssids(self, data_frame):
-        def extend_lists(data):
-            result = defaultdict(list)
-            for list_ in data:
-                k, v = list_[0], list_[1]
-                result[k].extend([v])
-            return dict(result)
-
-        dates = list(data_frame.sort_values('epoch')['epoch'])
-        self.running_median = dates[len(dates) // 2].value
-        df_agg = data_frame.groupby(['ie', 'ssid'])[['ap', 'rssi']].apply(lambda g: g.values.tolist()).apply(lambda x: extend_lists(x)).reset_index(name='measurement')
-        return df_agg
-
-    def _localize(self, data_frame):
-        data_frame['localization'] = data_frame['measurement'].apply(lambda x: self.Localizer.localize(x))
-        data_frame = data_frame.drop('measurement', axis=1)
+        epochs = data_frame['epoch'].values.astype('datetime64[ns]').view('int64')
+        self.running_median = int(np.partition(epochs, len(epochs) // 2)[len(epochs) // 2])
+        groups = data_frame.groupby(['ie', 'ssid'], sort=True)
+        group_codes = groups.ngroup().values
+        ap_codes, aps = pd.factorize(data_frame['ap'], sort=True)
+        cells = group_codes * len(aps) + ap_codes
+        sums = np.bincount(cells, weights=data_frame['rssi'].values.astype(float), minlength=groups.ngroups * len(aps))
+        counts = np.bincount(cells, minlength=groups.ngroups * len(aps))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rssi = np.where(counts > 0, sums / counts, np.nan).reshape(groups.ngroups, len(aps))
+        keys = groups.size().index.to_frame(index=False)
+        return IntervalMeasurements(keys, np.asarray(aps), rssi, self.running_median)
+
+    def _starting_points(self, measurements):
+        return self.Localizer.starting_points(len(measurements.rssi), self.Localizer.interval_rng(measurements.running_median))
+
+    def _localize(self, measurements):
+        regions, locations = self.Localizer.locate_matrix(measurements.aps, measurements.rssi, self._last_known_locations(measurements.keys), self._starting_points(measurements))
+        self._remember_locations(measurements.keys, locations)
+        return measurements.keys.assign(localization=regions)
+
+    def _last_known_locations(self, keys):
+        unknown = (np.nan, np.nan)
+        return np.array([self.last_locations.get(key, unknown) for key in zip(keys['ie'], keys['ssid'])], dtype=float).reshape(-1, 2)
+
+    def _remember_locations(self, keys, locations):
+        if self.Localizer.multistart != 'adaptive':
+            return
+        for key, location in zip(zip(keys['ie'], keys['ssid']), map(tuple, locations)):
+            self.last_locations[key] = location
+            self.last_locations.move_to_end(key)
+        while len(self.last_locations) > self.max_last_locations:
+            self.last_locations.popitem(last=False)
+
+    def _submit_localization(self, measurements):
+        completed = []
+        if self.Localizer.multistart == 'adaptive':
+            completed = self._collect_localizations(0)
+        chunk_size = -(-len(measurements.rssi) // self.workers)
+        seeds, x0s = self._last_known_locations(measurements.keys), self._starting_points(measurements)
+        futures = [self.pool.submit(localize_in_worker, measurements.aps, measurements.rssi[i:i + chunk_size], seeds[i:i + chunk_size], x0s[i:i + chunk_size])
+                   for i in range(0, len(measurements.rssi), chunk_size)]
+        self.pending_localizations.append((measurements, futures))
+        return completed + self._collect_localizations(2 * self.workers)
+
+    def _collect_localizations(self, max_pending):
+        completed = []
+        while self.pending_localizations:
+            measurements, futures = self.pending_localizations[0]
+            if len(self.pending_localizations) <= max_pending and not all(future.done() for future in futures):
+                break
+            self.pending_localizations.popleft()
+            results = [future.result() for future in futures]
+            localization = [regions for result in results for regions in result[0]]
+            self._remember_locations(measurements.keys, np.concatenate([result[1] for result in results]))
+            completed.append((measurements.running_median, measurements.keys.assign(localization=localization)))
+        return completed
+
+    def _restore_interval(self, localized_interval):
+        self.running_median, data_frame = localized_interval
         return data_frame
 
     def _interpret_results(self, data_frame):
         for entry in data_frame.to_dict(orient='records'):
             previous_appearance = self.database.get_previous_appearance_ie_ssid(entry)
             if previous_appearance:
-                previous_most_recent_timestamp = int(max(list(previous_appearance[entry['ssid']].keys())))
+                previous_most_recent_timestamp = previous_appearance['timestamp']
                 if self.running_median - previous_most_recent_timestamp < self.in_burst_threshold_in_s * 1e+9:
                     self.print('Combination of IE and SSID has been seen before. Could be of same burst though')
                 else:
@@ -120,15 +287,13 @@ class ScavengerAnalyzer:
                 equal_ie = self.database.get_previous_appearance_ie(entry)
                 if equal_ie:
                     self.print('Known Pattern of IEs ... Starting Location based Analysis:')
-                    del equal_ie['_id']
-                    del equal_ie['ie']
-                    latest_entry = max([max(v.keys()) for k, v in equal_ie.items()])
-                    time_since_latest_entry = int((self.running_median - int(latest_entry)) / 1e+9)
-                    latest_known_ssid, latest_regions_of_presence = [(k, v[latest_entry]) for k, v in equal_ie.items() if latest_entry in v.keys()][0]
+                    time_since_latest_entry = int((self.running_median - equal_ie['timestamp']) / 1e+9)
+                    latest_known_ssid, latest_regions_of_presence = equal_ie['ssid'], equal_ie['regions']
                     if time_since_latest_entry < 0:
                         raise Exception()
                     is_possible_equal, previous, actual, distance = self.Localizer.is_equal(
-                        latest_regions_of_presence, entry['localization'], time_since_latest_entry, self.assumed_walking_speed_km_per_h
+                        latest_regions_of_presence, entry['localization'], time_since_latest_entry, self.assumed_walking_speed_km_per_h,
+                        previous_key=(entry['ie'], latest_known_ssid, equal_ie['timestamp']), actual_key=(entry['ie'], entry['ssid'], self.running_median)
                     )
                     if is_possible_equal:
                         self.database.add_ssid_alias(latest_known_ssid, entry)
@@ -149,14 +314,46 @@ class ScavengerAnalyzer:
         for entry in data.to_dict(orient='records'):
             for region in entry['localization']:
                 self.database.add_region_to_entry(entry, self.running_median, region)
+        self.database.flush()
+        self.latest_stored_interval = self.running_median
+
+    def compare_multistart(self, data_path, is_dir):
+        intervals = []
+        source, _, split, grouped = self._grouping_stream()
+        grouped.sink(intervals.append)
+        self._emit_files(source, data_path, is_dir)
+        self._drain(split, None)
+        amount_of_devices = sum(len(measurements.rssi) for measurements in intervals)
+        configured_multistart, configured_seed = self.Localizer.multistart, self.Localizer.seed
+        runs = []
+        try:
+            for name, multistart, seed in (('fixed', 'fixed', configured_seed), ('fixed (repeated)', 'fixed', None), ('adaptive', 'adaptive', configured_seed)):
+                # without a seed the repeated run draws from the localizer's running generator instead of
+                # the per-interval ones, so it measures the run-to-run variance even when --seed is set
+                self.Localizer.multistart, self.Localizer.seed = multistart, seed
+                self.last_locations = OrderedDict()
+                started = time.perf_counter()
+                localization = [regions for measurements in intervals for regions in self._localize(measurements)['localization']]
+                runs.append((name, time.perf_counter() - started, localization))
+        finally:
+            self.Localizer.multistart, self.Localizer.seed = configured_multistart, configured_seed
+            self.last_locations = OrderedDict()
+        reference = runs[0][2]
+        comparison = []
+        for name, duration, localization in runs:
+            agreeing = sum(self.Localizer.is_equal(a, b, 0, self.assumed_walking_speed_km_per_h)[0] for a, b in zip(reference, localization))
+            comparison.append((name, amount_of_devices / duration if duration else float('inf'), agreeing / amount_of_devices if amount_of_devices else 1.0))
+        return amount_of_devices, comparison
+
+    def summary_counts(self):
+        return self.database.get_document_count(), self.database.get_uniquely_seen(), self.database.get_non_randomizing(), self.database.get_randomizing()
 
     def summary(self):
-        unqiue_ids = self.database.get_document_count()
-        uniquely_seen_ids = self.database.get_uniquely_seen()
-        non_randomizing_devices = self.database.get_non_randomizing()
-        randomizing_devices = self.database.get_randomizing()
+        unqiue_ids, uniquely_seen_ids, non_randomizing_devices, randomizing_devices = self.summary_counts()
 
         print('Summary:')
         print('Approximately {0} different recognizable devices on site that were detected by at minimum {1} APs'.format(unqiue_ids, self.min_device_detection_rate))
         print('Thereof, {0} devices were seen just once, while {1} were seen multiple times'.format(uniquely_seen_ids, non_randomizing_devices + randomizing_devices))
         print('{0} devices were using MAC Randomization, {1} were not applying Randomization techniques'.format(randomizing_devices, non_randomizing_devices))
+        if self.late_records():
+            print('{} records arrived after their interval had been analyzed and were dropped'.format(self.late_records()))
@@ -0,0 +1,107 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+CAPTURE_EXTENSION = '.npz'
+CAPTURE_FORMAT_VERSION = 1
+DICTIONARY_COLUMNS = ['ap', 'ie', 'ssid']
+
+
+class CaptureColumnBuilder:
+    def __init__(self):
+        self.dictionaries = {column: {} for column in DICTIONARY_COLUMNS}
+        self.codes = {column: [] for column in DICTIONARY_COLUMNS}
+        self.epochs = []
+        self.rssis = []
+
+    def extend(self, records):
+        for column in DICTIONARY_COLUMNS:
+            dictionary = self.dictionaries[column]
+            self.codes[column].append(np.array([dictionary.setdefault(record[column], len(dictionary)) for record in records], dtype=np.int64))
+        self.epochs.append(np.round(np.asarray([record['epoch'] for record in records], dtype=np.float64)).astype(np.int64)
+                           if any(isinstance(record['epoch'], float) for record in records)
+                           else np.asarray([record['epoch'] for record in records], dtype=np.int64))
+        self.rssis.append(np.asarray([record['rssi'] for record in records], dtype=np.int8))
+
+    def columns(self):
+        columns = {'version': np.array(CAPTURE_FORMAT_VERSION)}
+        for column in DICTIONARY_COLUMNS:
+            dictionary = self.dictionaries[column]
+            columns[column + '_dictionary'] = np.array(list(dictionary.keys()), dtype=str) if dictionary else np.array([], dtype=str)
+            codes = np.concatenate(self.codes[column]) if self.codes[column] else np.array([], dtype=np.int64)
+            columns[column] = codes.astype(np.min_scalar_type(max(len(dictionary) - 1, 0)))
+        columns['epoch'] = np.concatenate(self.epochs) if self.epochs else np.array([], dtype=np.int64)
+        columns['rssi'] = np.concatenate(self.rssis) if self.rssis else np.array([], dtype=np.int8)
+        return columns
+
+
+def records_to_columns(records):
+    builder = CaptureColumnBuilder()
+    builder.extend(records)
+    return builder.columns()
+
+
+def write_capture(records, out_, compress=True):
+    if compress:
+        np.savez_compressed(out_, **records_to_columns(records))
+    else:
+        np.savez(out_, **records_to_columns(records))
+
+
+def capture_to_bytes(records, compress=True):
+    buffer = io.BytesIO()
+    write_capture(records, buffer, compress)
+    return buffer.getvalue()
+
+
+def read_capture_columns(path):
+    with np.load(path, allow_pickle=False) as capture:
+        if int(capture['version']) != CAPTURE_FORMAT_VERSION:
+            raise ValueError('{0} has capture format version {1}, expected {2}'.format(path, int(capture['version']), CAPTURE_FORMAT_VERSION))
+        return {key: capture[key] for key in capture.files}
+
+
+def iter_capture_chunks(path, records_per_chunk=50000):
+    columns = read_capture_columns(path)
+    if len(columns['epoch']) == 0:
+        raise ValueError('{} contains no records'.format(path))
+    for start in range(0, len(columns['epoch']), records_per_chunk):
+        end = start + records_per_chunk
+        chunk = {column: columns[column + '_dictionary'][columns[column][start:end]].astype(object) for column in DICTIONARY_COLUMNS}
+        chunk['epoch'] = columns['epoch'][start:end]
+        chunk['rssi'] = columns['rssi'][start:end].astype(np.int64)
+        yield pd.DataFrame(chunk, columns=['ap', 'epoch', 'ie', 'rssi', 'ssid'])
+
+
+def convert_json_capture(json_path, capture_path, compress=True):
+    from MacScavengerIngest import iter_json_record_batches
+    builder = CaptureColumnBuilder()
+    for records in iter_json_record_batches(json_path):
+        builder.extend(records)
+    columns = builder.columns()
+    if compress:
+        np.savez_compressed(capture_path, **columns)
+    else:
+        np.savez(capture_path, **columns)
+    return len(columns['epoch'])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python MacScavengerCaptureFormat.py JSON_FILE_OR_DIRECTORY [OUTPUT_FILE_OR_DIRECTORY]')
+        sys.exit(1)
+    source = sys.argv[1]
+    if os.path.isdir(source):
+        target = sys.argv[2] if len(sys.argv) > 2 else source
+        os.makedirs(target, exist_ok=True)
+        conversions = [(os.path.join(source, name), os.path.join(target, os.path.splitext(name)[0] + CAPTURE_EXTENSION))
+                       for name in sorted(os.listdir(source)) if name.endswith('.json')]
+    else:
+        conversions = [(source, sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + CAPTURE_EXTENSION)]
+    for json_path, capture_path in conversions:
+        amount = convert_json_capture(json_path, capture_path)
+        print('Converted {0} records from {1} to {2} ({3} -> {4} bytes)'
+              .format(amount, json_path, capture_path, os.path.getsize(json_path), os.path.getsize(capture_path)))
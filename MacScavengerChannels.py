@@ -0,0 +1,120 @@
+import time
+from threading import Event, Lock
+
+DEFAULT_CHANNELS = [1, 3, 5, 7, 9, 11, 13]
+DEFAULT_DWELL_IN_S = 0.25
+
+
+class ChannelSchedule:
+
+    def __init__(self, channels=None, dwells=None, start=0.0):
+        self.channels = list(channels or DEFAULT_CHANNELS)
+        self.dwells = list(dwells or [DEFAULT_DWELL_IN_S] * len(self.channels))
+        self.start = start
+
+    def cycle(self):
+        return sum(self.dwells)
+
+    def slot_at(self, now):
+        position = (now - self.start) % self.cycle()
+        for channel, dwell in zip(self.channels, self.dwells):
+            if position < dwell:
+                return channel, dwell - position
+            position -= dwell
+        return self.channels[-1], 0.0
+
+    def to_command(self):
+        return 'schedule start={:.3f} channels={} dwells={}'.format(
+            self.start, ','.join(map(str, self.channels)), ','.join('{:.3f}'.format(dwell) for dwell in self.dwells))
+
+    @classmethod
+    def from_options(cls, options):
+        channels = [int(channel) for channel in options['channels'].split(',')]
+        dwells = [float(dwell) for dwell in options['dwells'].split(',')]
+        if len(channels) != len(dwells) or min(dwells) <= 0:
+            raise ValueError('Every channel needs a positive dwell time')
+        return cls(channels, dwells, float(options['start']))
+
+
+class ChannelHopper:
+
+    def __init__(self, schedule=None):
+        self.schedule = schedule or ChannelSchedule()
+        self.channel = None
+        self.lock = Lock()
+        self.changed = Event()
+        self.yields = {}
+
+    def set_schedule(self, schedule):
+        self.schedule = schedule
+        self.changed.set()
+
+    def count(self, record):
+        channel = record.pop('channel', None)
+        with self.lock:
+            if channel is None:
+                channel = self.channel
+            if channel is not None:
+                self.yields.setdefault(channel, [0, 0.0])[0] += 1
+        return record
+
+    def stats(self):
+        with self.lock:
+            return {channel: {'records': records, 'dwell': dwell} for channel, (records, dwell) in self.yields.items()}
+
+    def run(self, running, set_channel):
+        while running[0]:
+            channel, remaining = self.schedule.slot_at(time.time())
+            if channel != self.channel:
+                set_channel(channel)
+                with self.lock:
+                    self.channel = channel
+                    self.yields.setdefault(channel, [0, 0.0])
+            started = time.monotonic()
+            self.changed.wait(remaining)
+            self.changed.clear()
+            with self.lock:
+                self.yields[channel][1] += time.monotonic() - started
+        with self.lock:
+            self.channel = None
+
+
+class ChannelPlanner:
+
+    def __init__(self, channels=None, cycle_in_s=None, min_dwell_in_s=0.1, smoothing=0.5):
+        self.channels = list(channels or DEFAULT_CHANNELS)
+        self.cycle_in_s = cycle_in_s or DEFAULT_DWELL_IN_S * len(self.channels)
+        self.min_dwell_in_s = min(min_dwell_in_s, self.cycle_in_s / len(self.channels))
+        self.smoothing = smoothing
+        self.rates = {}
+        self.totals = {channel: [0, 0.0] for channel in self.channels}
+        self.schedule = self.plan_evenly()
+
+    def update(self, yields):
+        for channel, (records, dwell) in yields.items():
+            if channel not in self.totals or dwell <= 0:
+                continue
+            self.totals[channel][0] += records
+            self.totals[channel][1] += dwell
+            rate = records / dwell
+            previous = self.rates.get(channel)
+            self.rates[channel] = rate if previous is None else self.smoothing * previous + (1 - self.smoothing) * rate
+
+    def plan_evenly(self, now=0.0):
+        self.schedule = ChannelSchedule(self.channels, [self.cycle_in_s / len(self.channels)] * len(self.channels), now)
+        return self.schedule
+
+    def plan(self, now):
+        rates = [self.rates.get(channel, 0.0) for channel in self.channels]
+        if sum(rates) == 0:
+            return self.plan_evenly(now)
+        spare = self.cycle_in_s - self.min_dwell_in_s * len(self.channels)
+        self.schedule = ChannelSchedule(self.channels, [self.min_dwell_in_s + spare * rate / sum(rates) for rate in rates], now)
+        return self.schedule
+
+    def report(self):
+        rows = []
+        for channel, dwell in zip(self.channels, self.schedule.dwells):
+            records, heard = self.totals[channel]
+            rows.append([channel, records, round(heard, 1), round(self.rates.get(channel, 0.0), 2), round(dwell, 3)])
+        return rows
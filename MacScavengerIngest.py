@@ -0,0 +1,73 @@
+import json
+
+import pandas as pd
+
+RECORD_KEYS = ['ap', 'epoch', 'ie', 'rssi', 'ssid']
+RECORD_KEY_SET = set(RECORD_KEYS)
+
+
+def is_record_valid(record):
+    return isinstance(record, dict) and record.keys() == RECORD_KEY_SET
+
+
+def iter_json_record_batches(path, read_size=1 << 20):
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as in_:
+        buffer = in_.read(read_size)
+        position = 0
+        eof = not buffer
+        batch_decoding = True
+        count = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n[],':
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    break
+                buffer, position, batch_decoding = in_.read(read_size), 0, True
+                eof = not buffer
+                continue
+            if buffer[position] != '{':
+                raise ValueError('{0} is not a list of records (unexpected {1!r} at record {2})'.format(path, buffer[position], count))
+            end = buffer.rfind('}', position) + 1
+            if batch_decoding and end > position:
+                try:
+                    records = json.loads('[' + buffer[position:end] + ']')
+                except ValueError:
+                    batch_decoding = False
+                    continue
+            else:
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                    records = [record]
+                except ValueError:
+                    if eof:
+                        raise ValueError('{0} ends with an incomplete record'.format(path))
+                    chunk = in_.read(read_size)
+                    eof = not chunk
+                    buffer, position, batch_decoding = buffer[position:] + chunk, 0, True
+                    continue
+            if not all([is_record_valid(record) for record in records]):
+                invalid = count + [is_record_valid(record) for record in records].index(False)
+                raise ValueError('Record {0} in {1} does not have the fields {2}'.format(invalid, path, ', '.join(RECORD_KEYS)))
+            count += len(records)
+            yield records
+            position = end
+        if count == 0:
+            raise ValueError('{} contains no records'.format(path))
+
+
+def iter_json_records(path, read_size=1 << 20):
+    for records in iter_json_record_batches(path, read_size):
+        yield from records
+
+
+def iter_record_chunks(path, records_per_chunk=50000, read_size=1 << 20):
+    chunk = []
+    for records in iter_json_record_batches(path, read_size):
+        chunk.extend(records)
+        while len(chunk) >= records_per_chunk:
+            yield pd.DataFrame(chunk[:records_per_chunk], columns=RECORD_KEYS)
+            chunk = chunk[records_per_chunk:]
+    if chunk:
+        yield pd.DataFrame(chunk, columns=RECORD_KEYS)
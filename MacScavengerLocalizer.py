@@ -1,23 +1,60 @@
-import collections
-import itertools
-import random
+from collections import OrderedDict
 
 import numpy as np
-from scipy.ndimage import label
-from scipy.ndimage.filters import gaussian_filter
+from scipy.ndimage import correlate1d, find_objects, generate_binary_structure, label
 from scipy.optimize import least_squares
-from shapely.geometry import Polygon, LineString, Point
+import shapely
+from shapely import STRtree
 
 
 class MacScavengerLocalizer:
 
-    def __init__(self, ap_dict_pos):
+    def __init__(self, ap_dict_pos, seed=None):
         self.ap_dict_pos = ap_dict_pos
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
         self.bounds = self._get_bounds_from_positions()
         self.amount_of_draws = 20
         self.meter_per_bin = 0.5
         self.n = 2
         self.f_scale = 1
+        self.max_iterations = 100
+        self.tolerance = 1e-8
+        self.multistart = 'fixed'
+        self.draws_per_round = 6
+        self.seeded_draws = 2
+        self.minimum_separation = self.meter_per_bin
+        self.grid = LocalizationGrid(self.bounds, self.meter_per_bin)
+        self.geometries = RegionGeometryCache()
+
+    def localize_matrix(self, aps, rssi, seeds=None, x0s=None):
+        return self.locate_matrix(aps, rssi, seeds, x0s)[0]
+
+    def locate_matrix(self, aps, rssi, seeds=None, x0s=None):
+        positions = np.array([self.ap_dict_pos[ap] for ap in aps], dtype=float).reshape(-1, 2)
+        if x0s is None:
+            x0s = self.starting_points(len(rssi))
+        if self.multistart == 'adaptive':
+            approximations = self._calculate_multilateration_adaptive(positions, rssi, x0s, seeds)
+        else:
+            approximations = self._calculate_multilateration_batch(positions, rssi, x0s)
+        best = np.nanargmin(approximations[:, :, 0], axis=1) if len(approximations) else np.zeros(0, dtype=int)
+        locations = approximations[np.arange(len(approximations)), best, 1:]
+        return self._get_heatmap_peaks_batch(approximations), locations
+
+    def localize_many(self, measurements):
+        return self.localize_matrix(*self._measurements_to_matrix(measurements))
+
+    def interval_rng(self, key):
+        if self.seed is None:
+            return self.rng
+        return np.random.default_rng([self.seed, key])
+
+    def starting_points(self, amount_of_devices, rng=None):
+        if self.multistart == 'adaptive':
+            rounds = max(1, -(-(self.amount_of_draws - self.seeded_draws) // self.draws_per_round))
+            return self._draw_starting_points(amount_of_devices, self.seeded_draws + rounds * self.draws_per_round, rng)
+        return self._draw_starting_points(amount_of_devices, rng=rng)
 
     def localize(self, measurement):
         transformed_data = {self.ap_dict_pos[a]: b for a, b in measurement.items()}
@@ -25,29 +62,18 @@ class MacScavengerLocalizer:
         regions = self._get_heatmap_peaks(approximation)
         return regions
 
-    def is_equal(self, previous_regions, possible_actual_regions, timed_interval, km_per_h):
-        distances = []
-        possible_combinations = itertools.product(previous_regions, possible_actual_regions)
-        for prev, actual in possible_combinations:
-            if len(prev) >= 3:
-                previous_region = Polygon(prev)
-            elif len(prev) == 2:
-                previous_region = LineString(prev)
-            else:
-                previous_region = Point(prev[0])
-            if len(actual) >= 3:
-                actual_region = Polygon(actual)
-            elif len(actual) == 2:
-                actual_region = LineString(actual)
-            else:
-                actual_region = Point(actual[0])
-
-            max_possible_distance = timed_interval * (km_per_h / 3.6)
-            distance = previous_region.distance(actual_region) * self.meter_per_bin
-            distances.append(distance)
-            if distance <= max_possible_distance:
-                return True, prev, actual, distance
-        return False, None, None, min(distances)
+    def is_equal(self, previous_regions, possible_actual_regions, timed_interval, km_per_h, previous_key=None, actual_key=None):
+        previous_geometries, previous_tree = self.geometries.get(previous_key, previous_regions)
+        actual_geometries, _ = self.geometries.get(actual_key, possible_actual_regions)
+        max_possible_distance = timed_interval * (km_per_h / 3.6)
+        actual_index, previous_index = previous_tree.query(actual_geometries, predicate='dwithin', distance=max_possible_distance / self.meter_per_bin)
+        if len(previous_index):
+            first = np.lexsort((actual_index, previous_index))[0]
+            prev, actual = previous_index[first], actual_index[first]
+            distance = shapely.distance(previous_geometries[prev], actual_geometries[actual]) * self.meter_per_bin
+            return True, previous_regions[prev], possible_actual_regions[actual], distance
+        _, distances = previous_tree.query_nearest(actual_geometries, return_distance=True, all_matches=False)
+        return False, None, None, distances.min() * self.meter_per_bin
 
     def _distance_function(self, x, data, variance, var_impact):
         element_a = np.power([t[0] for t in data[:, 0]] - x[0], 2)
@@ -64,85 +90,247 @@ class MacScavengerLocalizer:
 
     def _calculate_multilateration_nonlinear(self, data):
         if self.amount_of_draws:
-            x = [random.uniform(self.bounds[0][0], self.bounds[1][0]) for a in range(self.amount_of_draws)]
-            y = [random.uniform(self.bounds[0][1], self.bounds[1][1]) for a in range(self.amount_of_draws)]
+            x = self.rng.uniform(self.bounds[0][0], self.bounds[1][0], self.amount_of_draws)
+            y = self.rng.uniform(self.bounds[0][1], self.bounds[1][1], self.amount_of_draws)
             x0s = np.array((x, y)).transpose()
         else:
-            x0s = np.array([[random.uniform(self.ap_dict_pos[0][0], self.ap_dict_pos[1][0]), random.uniform(self.ap_dict_pos[0][1], self.ap_dict_pos[1][1]), min(data['rssi'])]])
+            x0s = np.array([[self.rng.uniform(self.ap_dict_pos[0][0], self.ap_dict_pos[1][0]), self.rng.uniform(self.ap_dict_pos[0][1], self.ap_dict_pos[1][1]), min(data['rssi'])]])
         location = []
         mean_measurements = [[[k[0], k[1]], np.mean(v)] for k, v in data.items()]
         for x0 in x0s:
-            res_lsq_none = least_squares(self._distance_function, x0, loss='cauchy', f_scale=self.f_scale, bounds=self.bounds, args=(np.array(mean_measurements), 0, 'none'))
+            res_lsq_none = least_squares(self._distance_function, x0, loss='cauchy', f_scale=self.f_scale, bounds=self.bounds, args=(np.array(mean_measurements, dtype=object), 0, 'none'))
             location.append([res_lsq_none.cost, res_lsq_none.x[0], res_lsq_none.x[1]])
         return np.array(location)
 
+    def _measurements_to_matrix(self, measurements):
+        aps = sorted(set(ap for measurement in measurements for ap in measurement))
+        columns = {ap: i for i, ap in enumerate(aps)}
+        rssi = np.full((len(measurements), len(aps)), np.nan)
+        for i, measurement in enumerate(measurements):
+            for ap, values in measurement.items():
+                rssi[i, columns[ap]] = np.mean(values)
+        return aps, rssi
+
+    def _draw_starting_points(self, amount_of_devices, amount_of_draws=None, rng=None):
+        amount_of_draws = amount_of_draws or self.amount_of_draws
+        rng = rng or self.rng
+        x = rng.uniform(self.bounds[0][0], self.bounds[1][0], (amount_of_devices, amount_of_draws))
+        y = rng.uniform(self.bounds[0][1], self.bounds[1][1], (amount_of_devices, amount_of_draws))
+        return np.stack((x, y), axis=-1)
+
+    def _weighted_centroids(self, positions, rssi):
+        distances = np.power(np.power(10, (np.absolute(rssi) - 30) / (10 * self.n)), 2)
+        weights = np.where(np.isnan(rssi), 0, 1 / np.maximum(np.nan_to_num(distances, nan=1), 1e-9))
+        return weights @ positions / np.maximum(weights.sum(axis=1, keepdims=True), 1e-300)
+
+    def _calculate_multilateration_adaptive(self, positions, rssi, x0s, seeds=None):
+        amount_of_devices, per_round, seeded = len(rssi), self.draws_per_round, self.seeded_draws
+        x0s = x0s.copy()
+        x0s[:, 0] = self._weighted_centroids(positions, rssi)
+        if seeds is not None:
+            known = ~np.isnan(seeds).any(axis=1)
+            x0s[known, 1] = seeds[known]
+        location = np.full(x0s.shape[:2] + (3,), np.nan)
+        active = np.arange(amount_of_devices)
+        done, upcoming = 0, seeded + per_round
+        while upcoming <= x0s.shape[1]:
+            location[active, done:upcoming] = self._calculate_multilateration_batch(positions, rssi[active], x0s[active, done:upcoming])
+            done = max(done, seeded)
+            known_minima, new_minima = location[active, np.newaxis, :done, 1:], location[active, done:upcoming, np.newaxis, 1:]
+            is_new = (np.linalg.norm(new_minima - known_minima, axis=-1) > self.minimum_separation).all(axis=-1)
+            is_better = location[active, done:upcoming, 0] <= np.min(location[active, :done, 0], axis=-1, keepdims=True)
+            active = active[(is_new & is_better).any(axis=-1)]
+            if not len(active):
+                break
+            done, upcoming = upcoming, upcoming + per_round
+        return location
+
+    def _batch_residuals(self, x, positions, distances, mask):
+        delta = positions - x[:, np.newaxis, :]
+        residuals = np.where(mask, np.sum(np.power(delta, 2), axis=-1) - distances, 0)
+        jacobian = np.where(mask[..., np.newaxis], -2 * delta, 0)
+        return residuals, jacobian
+
+    def _cauchy_cost(self, residuals):
+        return 0.5 * self.f_scale ** 2 * np.sum(np.log1p(np.power(residuals / self.f_scale, 2)), axis=-1)
+
+    def _calculate_multilateration_batch(self, positions, rssi, x0s=None):
+        if x0s is None:
+            x0s = self._draw_starting_points(len(rssi))
+        amount_of_devices, amount_of_draws = x0s.shape[:2]
+        mask = np.repeat(~np.isnan(rssi), amount_of_draws, axis=0)
+        distances = np.power(np.power(10, (np.absolute(np.nan_to_num(rssi)) - 30) / (10 * self.n)), 2)
+        distances = np.repeat(distances, amount_of_draws, axis=0)
+        positions = np.broadcast_to(positions, mask.shape + (2,))
+        lower, upper = np.array(self.bounds[0], dtype=float), np.array(self.bounds[1], dtype=float)
+
+        x = np.clip(x0s.reshape(-1, 2), lower, upper)
+        damping = np.full(len(x), 1e-3)
+        radius = np.maximum(np.linalg.norm(x, axis=-1), 1)
+        residuals, jacobian = self._batch_residuals(x, positions, distances, mask)
+        cost = self._cauchy_cost(residuals)
+        active = np.arange(len(x))
+        for _ in range(self.max_iterations):
+            if not len(active):
+                break
+            residuals_, jacobian_, damping_ = residuals[active], jacobian[active], damping[active]
+            scaled = np.power(residuals_ / self.f_scale, 2)
+            first_derivative = residuals_ / (1 + scaled)
+            second_derivative = (1 - scaled) / np.power(1 + scaled, 2)
+            gradient = np.einsum('bm,bmi->bi', first_derivative, jacobian_)
+            hessian = np.einsum('bm,bmi,bmj->bij', second_derivative, jacobian_, jacobian_)
+            hessian += 2 * np.sum(first_derivative, axis=-1)[:, np.newaxis, np.newaxis] * np.eye(2)
+            half_trace = (hessian[:, 0, 0] + hessian[:, 1, 1]) / 2
+            spread = np.sqrt(np.power((hessian[:, 0, 0] - hessian[:, 1, 1]) / 2, 2) + np.power(hessian[:, 0, 1], 2))
+            shift = np.maximum(0, spread - half_trace) + damping_ * (np.abs(half_trace) + spread + 1e-12)
+            damped = hessian + shift[:, np.newaxis, np.newaxis] * np.eye(2)
+            determinant = damped[:, 0, 0] * damped[:, 1, 1] - damped[:, 0, 1] * damped[:, 1, 0]
+            determinant = np.where(np.abs(determinant) < 1e-300, 1e-300, determinant)
+            step_x = -(damped[:, 1, 1] * gradient[:, 0] - damped[:, 0, 1] * gradient[:, 1]) / determinant
+            step_y = -(damped[:, 0, 0] * gradient[:, 1] - damped[:, 1, 0] * gradient[:, 0]) / determinant
+            step = np.stack((step_x, step_y), axis=-1)
+            step_length = np.linalg.norm(step, axis=-1)
+            step *= np.minimum(1, radius[active] / np.maximum(step_length, 1e-300))[:, np.newaxis]
+            x_, cost_ = x[active], cost[active]
+            candidate = np.clip(x_ + step, lower, upper)
+            candidate_residuals, candidate_jacobian = self._batch_residuals(candidate, positions[active], distances[active], mask[active])
+            candidate_cost = self._cauchy_cost(candidate_residuals)
+
+            moved = np.linalg.norm(candidate - x_, axis=-1)
+            improved = candidate_cost < cost_
+            converged = improved & ((cost_ - candidate_cost) <= self.tolerance * np.maximum(cost_, 1))
+            converged |= improved & (moved <= self.tolerance * (1 + np.linalg.norm(x_, axis=-1)))
+            accepted = active[improved]
+            x[accepted] = candidate[improved]
+            residuals[accepted] = candidate_residuals[improved]
+            jacobian[accepted] = candidate_jacobian[improved]
+            cost[accepted] = candidate_cost[improved]
+            radius[active] = np.where(improved, np.maximum(radius[active], 2 * moved), 0.25 * moved)
+            damping[active] = np.clip(np.where(improved, damping_ / 3, damping_ * 4), 1e-12, 1e12)
+            active = active[~converged & (damping[active] < 1e12)]
+        location = np.concatenate((cost[:, np.newaxis], x), axis=-1)
+        return location.reshape(amount_of_devices, amount_of_draws, 3)
+
     def _get_bounds_from_positions(self):
         positions = np.array(list(self.ap_dict_pos.values()))
         min_x, max_x, min_y, max_y = min(positions[:, 0]), max(positions[:, 0]), min(positions[:, 1]), max(positions[:, 1])
         return ([min_x, min_y], [max_x, max_y])
 
-    def _calculate_normalized_weights(self, weights, from_=0.1, to_=0.9):
-        r = [from_ + (((x - min(weights)) * (to_ - from_)) / (max(weights) - min(weights))) for x in weights]
-        r_ = [1 - weight for weight in r]
-        return np.array(r_)
-
-    def _get_number_of_bins(self):
-        return [int(self.bounds[1][0] / self.meter_per_bin), int(self.bounds[1][1] / self.meter_per_bin)]
-
-    def _get_convex_hull(self, points):
-        point = collections.namedtuple("point", "x y")
-        points = [point(e[0], e[1]) for e in points]
-
-        def cross(p1, p2, p3):
-            return (p2.x - p1.x) * (p3.y - p1.y) - (p2.y - p1.y) * (p3.x - p1.x)
-
-        def slope(p1, p2):
-            return 1.0 * (p1.y - p2.y) / (p1.x - p2.x) if p1.x != p2.x else float('inf')
-
-        def dis(p1, p2):
-            return ((p1.x - p2.x) ** 2 + (p1.y - p2.y) ** 2) ** 0.5
-
-        start = min(points, key=lambda p: (p.x, p.y))
-        points.pop(points.index(start))
-
-        points_slopes = [(p, slope(p, start)) for p in points]
-        points_slopes.sort(key=lambda e: e[1])
-        points = []
-        i = 0
-        for j in range(1, len(points_slopes)):
-            if points_slopes[j][1] != points_slopes[i][1]:
-                if j - i == 1:
-                    points.append(points_slopes[i])
-                else:
-                    points_cl = sorted(points_slopes[i:j], key=lambda e: dis(start, e[0]))
-                    points.extend(points_cl)
-                i = j
-        points_cl = sorted(points_slopes[i:], key=lambda e: -dis(start, e[0]))
-        points.extend(points_cl)
-        points = [p[0] for p in points]
-
-        ans = [start]
-        for p in points:
-            ans.append(p)
-            while len(ans) > 2 and cross(ans[-3], ans[-2], ans[-1]) < 0:
-                ans.pop(-2)
-        return [[a[0], a[1]] for a in ans]
-
     def _get_heatmap_peaks(self, approx_points):
-        weights = self._calculate_normalized_weights(approx_points[:, 0])
-        histogram2d_90deg_clockwise, _, _ = np.histogram2d(np.array(approx_points)[:, 1], np.array(approx_points)[:, 2], weights=weights, density=True, range=[[0, 8], [0, 5]],
-                                                           bins=self._get_number_of_bins())
-        histogram2d = np.rot90(histogram2d_90deg_clockwise)
-        heatmap = gaussian_filter(histogram2d, sigma=1)
-        threshold = np.quantile(heatmap.flatten(), 0.95)
-        masked_heatmap = np.where(heatmap < threshold, 0, 1)
-        labels, numL = label(masked_heatmap)
-        label_indices = [(labels == i).nonzero() for i in range(1, numL + 1)]
-
-        regions = []
-        for label_index in label_indices:
-            region = np.array(label_index).transpose()
-            hull = self._get_convex_hull(region)
-            hull = [[int(b) for b in a] for a in hull]
-            regions.append(hull)
+        return self._get_heatmap_peaks_batch(np.asarray(approx_points, dtype=float)[np.newaxis])[0]
+
+    def _get_heatmap_peaks_batch(self, approximations):
+        heatmaps = self.grid.heatmaps(approximations[:, :, 1:], self.grid.normalize_weights(approximations[:, :, 0]))
+        return self.grid.peak_regions(heatmaps)
+
+
+def regions_to_geometries(regions):
+    lengths = np.fromiter(map(len, regions), dtype=int, count=len(regions))
+    coordinates = np.array([point for region in regions for point in region], dtype=float).reshape(-1, 2)
+    owners = np.repeat(np.arange(len(regions)), lengths)
+    geometries = np.empty(len(regions), dtype=object)
+    is_point, is_line, is_polygon = lengths == 1, lengths == 2, lengths >= 3
+    if is_point.any():
+        geometries[is_point] = shapely.points(coordinates[is_point[owners]])
+    if is_line.any():
+        selected = is_line[owners]
+        shapely.linestrings(coordinates[selected], indices=owners[selected], out=geometries)
+    if is_polygon.any():
+        selected = is_polygon[owners]
+        rings = np.empty(len(regions), dtype=object)
+        shapely.linearrings(coordinates[selected], indices=owners[selected], out=rings)
+        geometries[is_polygon] = shapely.polygons(rings[is_polygon])
+    return geometries
+
+
+class RegionGeometryCache:
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key, regions):
+        if key is None:
+            return self.build(regions)
+        found = self.entries.get(key)
+        if found is None:
+            found = self.entries[key] = self.build(regions)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return found
+
+    def build(self, regions):
+        geometries = regions_to_geometries(regions)
+        return geometries, STRtree(geometries)
+
+
+class LocalizationGrid:
+
+    def __init__(self, bounds, meter_per_bin, sigma=1, truncate=4.0, quantile=0.95):
+        self.origin = np.array(bounds[0], dtype=float)
+        extent = np.array(bounds[1], dtype=float) - self.origin
+        self.bins = np.maximum((extent / meter_per_bin).astype(int), 1)
+        self.bin_size = np.where(extent > 0, extent, meter_per_bin) / self.bins
+        self.x_edges = self.origin[0] + np.arange(self.bins[0] + 1) * self.bin_size[0]
+        self.y_edges = self.origin[1] + np.arange(self.bins[1] + 1) * self.bin_size[1]
+        self.shape = (int(self.bins[1]), int(self.bins[0]))
+        radius = int(truncate * sigma + 0.5)
+        kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+        self.kernel = kernel / kernel.sum()
+        self.quantile = quantile
+        self.structure = np.zeros((3, 3, 3), dtype=bool)
+        self.structure[1] = generate_binary_structure(2, 1)
+
+    def normalize_weights(self, costs, from_=0.1, to_=0.9):
+        lowest = np.nanmin(costs, axis=-1, keepdims=True)
+        spread = np.nanmax(costs, axis=-1, keepdims=True) - lowest
+        scaled = np.divide(costs - lowest, spread, out=np.full_like(costs, 0.5), where=spread > 0)
+        return np.where(np.isnan(costs), 0, 1 - (from_ + scaled * (to_ - from_)))
+
+    def heatmaps(self, points, weights):
+        amount_of_devices, amount_of_points, _ = points.shape
+        points = np.where(np.isnan(points), self.origin, points)
+        cells = np.floor((points - self.origin) / self.bin_size).astype(int)
+        cells = np.clip(cells, 0, self.bins - 1)
+        rows = self.shape[0] - 1 - cells[:, :, 1]
+        flat = (np.arange(amount_of_devices)[:, np.newaxis] * self.shape[0] + rows) * self.shape[1] + cells[:, :, 0]
+        histograms = np.bincount(flat.ravel(), weights=weights.ravel(), minlength=amount_of_devices * self.shape[0] * self.shape[1])
+        histograms = histograms.reshape(amount_of_devices, *self.shape)
+        histograms /= np.maximum(histograms.sum(axis=(1, 2), keepdims=True), np.finfo(float).tiny) * np.prod(self.bin_size)
+        histograms = correlate1d(histograms, self.kernel, axis=1, mode='reflect')
+        return correlate1d(histograms, self.kernel, axis=2, mode='reflect')
+
+    def peak_regions(self, heatmaps):
+        thresholds = np.quantile(heatmaps.reshape(len(heatmaps), -1), self.quantile, axis=1)
+        labels, _ = label(heatmaps >= thresholds[:, np.newaxis, np.newaxis], structure=self.structure)
+        regions = [[] for _ in range(len(heatmaps))]
+        for index, found in enumerate(find_objects(labels), start=1):
+            device_slice, row_slice, col_slice = found
+            rows, cols = np.nonzero(labels[found][0] == index)
+            hull = self.convex_hull(rows + row_slice.start, cols + col_slice.start)
+            regions[device_slice.start].append(hull)
         return regions
+
+    @staticmethod
+    def convex_hull(rows, cols):
+        first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        last = np.r_[first[1:], len(rows)] - 1
+        candidates = np.unique(np.concatenate((np.stack((rows[first], cols[first]), axis=1), np.stack((rows[last], cols[last]), axis=1))), axis=0).tolist()
+        if len(candidates) < 3:
+            return candidates
+
+        def cross(o, a, b):
+            return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+        lower, upper = [], []
+        for point in candidates:
+            while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+                lower.pop()
+            lower.append(point)
+        for point in reversed(candidates):
+            while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+                upper.pop()
+            upper.append(point)
+        return lower[:-1] + upper[:-1]
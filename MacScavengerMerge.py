@@ -0,0 +1,65 @@
+import heapq
+from bisect import bisect_right
+from operator import itemgetter
+
+by_epoch = itemgetter('epoch')
+
+
+class WatermarkMerger:
+
+    def __init__(self, allowed_lateness_in_s=5, sources=()):
+        self.allowed_lateness = int(allowed_lateness_in_s * 1e9)
+        self.sources = set(sources)
+        self.buffers = {}
+        self.latest = {}
+        self.late_records = {}
+        self.watermark = None
+
+    def push(self, source, records, clock_offset=0):
+        if clock_offset:
+            records = [dict(record, epoch=record['epoch'] + clock_offset) for record in records]
+        records = sorted(records, key=by_epoch)
+        epochs = [record['epoch'] for record in records]
+        late = []
+        if self.watermark is not None:
+            cut = bisect_right(epochs, self.watermark)
+            late, records, epochs = records[:cut], records[cut:], epochs[cut:]
+            self.late_records[source] = self.late_records.get(source, 0) + len(late)
+        if records:
+            buffered_epochs, buffered = self.buffers.setdefault(source, ([], []))
+            out_of_order = buffered_epochs and epochs[0] < buffered_epochs[-1]
+            buffered_epochs.extend(epochs)
+            buffered.extend(records)
+            if out_of_order:
+                buffered.sort(key=by_epoch)
+                buffered_epochs.sort()
+            self.latest[source] = max(self.latest.get(source, epochs[-1]), epochs[-1])
+        if not self.latest:
+            return [], late
+        self.sources.add(source)
+        watermark = max(self.latest.values()) - self.allowed_lateness
+        if self.sources.issubset(self.latest):
+            watermark = max(watermark, min(self.latest.values()))
+        return self._release(watermark), late
+
+    def advance(self, now):
+        return self._release(now - self.allowed_lateness)
+
+    def flush(self):
+        if not self.latest:
+            return []
+        return self._release(max(self.latest.values()))
+
+    def _release(self, watermark):
+        if self.watermark is not None and watermark <= self.watermark:
+            return []
+        self.watermark = watermark
+        released = []
+        for buffered_epochs, buffered in self.buffers.values():
+            cut = bisect_right(buffered_epochs, watermark)
+            if cut:
+                released.append(buffered[:cut])
+                del buffered_epochs[:cut], buffered[:cut]
+        if len(released) == 1:
+            return released[0]
+        return list(heapq.merge(*released, key=by_epoch))
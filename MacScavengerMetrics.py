@@ -0,0 +1,81 @@
+import json
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def count_rows(data):
+    if data is None:
+        return 0
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    if hasattr(data, 'rssi'):
+        return len(data.rssi)
+    if isinstance(data, list):
+        return sum(count_rows(item) for item in data)
+    if isinstance(data, tuple):
+        return count_rows(data[-1])
+    return 1
+
+
+class PipelineMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = OrderedDict()
+        self.gauges = OrderedDict()
+
+    def wrap(self, name, function, gauges=None):
+        stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0})
+
+        def measured(data):
+            started = time.perf_counter()
+            result = function(data)
+            stage['seconds'] += time.perf_counter() - started
+            stage['calls'] += 1
+            stage['rows_in'] += count_rows(data)
+            for gauge, sample in (gauges or {}).items():
+                self.gauge(gauge, sample())
+            if hasattr(result, '__next__'):
+                return self._measure_iterator(stage, result)
+            stage['rows_out'] += count_rows(result)
+            return result
+        return measured
+
+    def _measure_iterator(self, stage, iterator):
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stage['seconds'] += time.perf_counter() - started
+                return
+            stage['seconds'] += time.perf_counter() - started
+            stage['rows_out'] += count_rows(item)
+            yield item
+
+    def gauge(self, name, value):
+        gauge = self.gauges.setdefault(name, {'samples': 0, 'last': 0, 'max': 0, 'mean': 0.0})
+        gauge['samples'] += 1
+        gauge['last'] = value
+        gauge['max'] = max(gauge['max'], value)
+        gauge['mean'] += (value - gauge['mean']) / gauge['samples']
+
+    def to_dict(self):
+        return {'total_seconds': time.perf_counter() - self.started, 'stages': self.stages, 'gauges': self.gauges}
+
+    def export(self, path):
+        with open(path, 'w') as out_:
+            json.dump(self.to_dict(), out_, indent=2)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        lines = ['Stage breakdown ({0:.2f} s total):'.format(total),
+                 '{0:<22}{1:>8}{2:>11}{3:>8}{4:>11}{5:>11}'.format('Stage', 'Calls', 'Seconds', 'Share', 'Rows In', 'Rows Out')]
+        for name, stage in self.stages.items():
+            share = stage['seconds'] / total if total else 0
+            lines.append('{0:<22}{calls:>8}{seconds:>11.3f}{1:>7.1f}%{rows_in:>11}{rows_out:>11}'.format(name, 100 * share, **stage))
+        for name, gauge in self.gauges.items():
+            lines.append('{0}: max {max}, mean {mean:.1f}, last {last}'.format(name, **gauge))
+        return '\n'.join(lines)
@@ -1,4 +1,3 @@
-import hashlib
 import json
 import socketserver
 import subprocess
@@ -6,42 +5,47 @@ import sys
 import time
 from collections import deque
 from pathlib import Path
-from threading import Thread
+from threading import Lock, Thread
 
 import psutil
 import pyric.pyw as pyw
 from streamz import Stream
 
+from MacScavengerChannels import ChannelHopper, ChannelSchedule
+from MacScavengerPacket import PcapStreamParser, parse_ek_record
+from MacScavengerProtocol import COMPRESSIONS, PROTOCOL_VERSION, RecordBatcher, encode_hello, encode_stats, parse_command
+from MacScavengerSpool import Spool
+
 pid = 9999
+read_size = 65536
+parsers = ('ek', 'pcap')
+spool = None
+spool_settings = {}
+spool_lock = Lock()
+spool_directory = './spool'
+stats_interval_in_s = 5
+hopper = ChannelHopper()
 capture = deque(maxlen=1)
 
 
 class MacScavengerTCPHandler(socketserver.BaseRequestHandler):
 
     def pack_data(self, data_in):
-        data = json.loads(data_in)
-        epoch = data['layers']['frame']['frame_frame_time_epoch']
-        rssi = data['layers']['radiotap']['radiotap_radiotap_dbm_antsignal']
-        ssid = data['layers']['wlan'][0]['wlan_wlan_ta']
-        ie = data['layers']['wlan'][1]
-        result = {'ap': name,
-                  'epoch': float(epoch) * 10e9,
-                  'rssi': int(rssi),
-                  'ie': hashlib.md5(json.dumps(ie, sort_keys=True).encode()).hexdigest(),
-                  'ssid': ssid
-                  }
-        return result
+        return parse_ek_record(data_in, name)
 
     def switch_channel_loop(self, capture):
         mon0 = pyw.getcard('mon0')
-        channel_range = [1, 3, 5, 7, 9, 11, 13]
-        i = 0
-        while capture[0]:
-            s = 'Listening on channel {}'.format(channel_range[i])
+
+        def set_channel(channel):
+            s = 'Listening on channel {}'.format(channel)
             print('\033[1A{}\033[K'.format(s))
-            pyw.chset(mon0, channel_range[i], None)
-            time.sleep(0.25)
-            i = (i + 1) % len(channel_range)
+            pyw.chset(mon0, channel, None)
+
+        hopper.run(capture, set_channel)
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
 
     def setup_ap(self):
 
@@ -92,44 +96,164 @@ class MacScavengerTCPHandler(socketserver.BaseRequestHandler):
             self.request.sendall('1'.encode())
 
     def transmit_stream(self, data):
-        self.request.sendall(json.dumps(data).encode())
+        if self.protocol >= 2:
+            self.batcher.add(data)
+        else:
+            self.request.sendall(json.dumps(data).encode())
 
     def store_local(self, data):
         if len(data) > 0:
             from_ = min([data_['epoch'] for data_ in data])
             to_ = max([data_['epoch'] for data_ in data])
             Path('./json_data').mkdir(parents=True, exist_ok=True)
-            with open('./json_data/{0}-{1}.json'.format(from_, to_), 'w+') as out_:
-                json.dump(data, out_)
+            if capture_format == 'npz':
+                from MacScavengerCaptureFormat import write_capture
+                with open('./json_data/{0}-{1}.npz'.format(from_, to_), 'wb') as out_:
+                    write_capture(data, out_)
+            else:
+                with open('./json_data/{0}-{1}.json'.format(from_, to_), 'w+') as out_:
+                    json.dump(data, out_)
         else:
             pass
 
-    def start_monitor(self):
-        command_1 = ['tshark',
-                     '-i',
-                     'mon0',
-                     '-Q',
-                     '-l',
-                     '-T',
-                     'ek',
-                     'type mgt subtype probe-req'
-                     ]
+    def start_monitor(self, protocol=1, batch_size=1, latency_in_ms=0, compression='none', parser='ek', spool_in_mb=0, resume=None):
+        self.protocol = min(protocol, PROTOCOL_VERSION)
+        if compression not in COMPRESSIONS:
+            compression = 'none'
+        if parser not in parsers or self.protocol < 2:
+            parser = 'ek'
+        self.send_lock = Lock()
+        self.connected = True
+        if self.protocol >= 2:
+            Thread(target=self.receive_commands, daemon=True).start()
+            Thread(target=self.report_channels, daemon=True).start()
+        if spool_in_mb > 0 and self.protocol >= 2 and storage != 'local':
+            self.stream_spool(dict(batch=max(1, batch_size), latency=latency_in_ms, compress=compression, parser=parser), spool_in_mb, resume)
+            return
+        self.batcher = RecordBatcher(self.send, batch_size, latency_in_ms, compression)
+        if self.protocol >= 2:
+            self.send(encode_hello(self.protocol, name=name, batch=self.batcher.batch_size,
+                                   latency=latency_in_ms, compress=compression, parser=parser))
+        self.capture_records(parser, self.transmit_stream)
+        try:
+            self.batcher.close()
+        except OSError:
+            pass
+        self.connected = False
+        print('Data Stream stopped')
+
+    def capture_records(self, parser, sink):
+        if parser == 'pcap':
+            command_1 = ['tshark',
+                         '-i',
+                         'mon0',
+                         '-Q',
+                         '-l',  # flush the pcap stream after every packet instead of in blocks
+                         '-F',
+                         'pcap',
+                         '-w',
+                         '-',
+                         'type mgt subtype probe-req'
+                         ]
+        else:
+            command_1 = ['tshark',
+                         '-i',
+                         'mon0',
+                         '-Q',
+                         '-l',
+                         '-T',
+                         'ek',
+                         'type mgt subtype probe-req'
+                         ]
 
         capture.append(True)
         channel_switch_thread = Thread(target=self.switch_channel_loop, args=(capture,))
         channel_switch_thread.start()
 
-        process = subprocess.Popen(command_1, stdout=subprocess.PIPE, universal_newlines=True)
+        process = subprocess.Popen(command_1, stdout=subprocess.PIPE, universal_newlines=parser == 'ek')
         global pid
         pid = process.pid
         source = Stream()
+        records = (source.map(self.pack_data) if parser == 'ek' else source).map(hopper.count)
         if storage == 'local':
             print('Local Storage')
-            source.map(self.pack_data).partition(50).sink(self.store_local)
+            records.partition(50).sink(self.store_local)
         else:
-            source.map(self.pack_data).sink(self.transmit_stream)
+            records.sink(sink)
 
         print('Data Stream Started!')
+        if parser == 'pcap':
+            self.emit_pcap(process, source)
+        else:
+            self.emit_ek(process, source)
+
+    def stream_spool(self, settings, spool_in_mb, resume):
+        global spool, spool_settings
+        with spool_lock:
+            if spool is None:
+                spool = Spool(spool_directory, spool_in_mb << 20)
+            spool.budget = spool_in_mb << 20
+            if not spool.capturing:
+                spool_settings = settings
+                spool.start_capture()
+                batcher = RecordBatcher(spool.append, settings['batch'], settings['latency'], settings['compress'])
+                Thread(target=self.capture_to_spool, args=(settings['parser'], batcher), daemon=True).start()
+        offset = spool.resume_offset(resume)
+        hello = dict(spool_settings, name=name, spool=spool_in_mb)
+        print('Streaming spool from offset {}'.format(offset))
+        try:
+            self.send(encode_hello(self.protocol, offset=offset, **hello))
+            more = True
+            while more and self.connected:
+                start, data, more = spool.read(offset, read_size)
+                if start != offset:
+                    self.send(encode_hello(self.protocol, offset=start, **hello))
+                if data:
+                    self.send(data)
+                offset = start + len(data)
+        except OSError:
+            pass
+        self.connected = False
+        print('Data Stream stopped')
+
+    def capture_to_spool(self, parser, batcher):
+        try:
+            self.capture_records(parser, batcher.add)
+        finally:
+            batcher.close()
+            spool.stop_capture()
+
+    def receive_commands(self):
+        pending = self.pending_commands
+        while self.connected:
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                command, options = parse_command(str(line, 'utf-8'))
+                if command == 'ack' and spool is not None:
+                    spool.acknowledge(int(options['offset']))
+                elif command == 'schedule':
+                    try:
+                        hopper.set_schedule(ChannelSchedule.from_options(options))
+                    except (KeyError, ValueError) as e:
+                        print('Ignoring channel schedule: {}'.format(e))
+            try:
+                data = self.request.recv(1024)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            pending += data
+        self.connected = False
+
+    def report_channels(self):
+        while self.connected:
+            time.sleep(stats_interval_in_s)
+            try:
+                self.send(encode_stats({'channels': hopper.stats()}))
+            except OSError:
+                break
+
+    def emit_ek(self, process, source):
         while process.returncode is None and capture[0]:
             data = process.stdout.readline()
             if '"_type": "pcap_file"' in data:
@@ -140,7 +264,18 @@ class MacScavengerTCPHandler(socketserver.BaseRequestHandler):
                 source.emit(data)
             except BrokenPipeError as bp:
                 break
-        print('Data Stream stopped')
+
+    def emit_pcap(self, process, source):
+        pcap = PcapStreamParser(name)
+        while process.returncode is None and capture[0]:
+            data = process.stdout.read1(read_size)
+            if not data:
+                break
+            try:
+                for record in pcap.feed(data):
+                    source.emit(record)
+            except BrokenPipeError as bp:
+                break
 
     def stop_monitor(self):
         try:
@@ -158,11 +293,19 @@ class MacScavengerTCPHandler(socketserver.BaseRequestHandler):
             print('Stopping to monitor failed! - Reason: {}'.format(e))
 
     def handle(self):
-        data = str(self.request.recv(1024).strip(), 'utf-8')
+        data, _, self.pending_commands = self.request.recv(1024).partition(b'\n')
+        data = str(data.strip(), 'utf-8')
+        command, options = parse_command(data) if data else ('', {})
         if data == 'setup_ap':
             self.setup_ap()
-        elif data == 'start_monitor':
-            self.start_monitor()
+        elif command == 'start_monitor':
+            self.start_monitor(int(options.get('proto', 1)),
+                               int(options.get('batch', 1)),
+                               int(options.get('latency', 0)),
+                               options.get('compress', 'none'),
+                               options.get('parser', 'ek'),
+                               int(options.get('spool', 0)),
+                               int(options['resume']) if 'resume' in options else None)
         elif data == 'stop_monitor':
             self.stop_monitor()
         else:
@@ -186,6 +329,11 @@ if __name__ == "__main__":
             except:
                 storage = 'remote'
                 print('Remote Storage')
+            try:
+                capture_format = sys.argv[4]
+            except:
+                capture_format = 'json'
+            print('Capture Format: {}'.format(capture_format))
             server.serve_forever()
             no_success = False
         except:
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import struct
+
+LINKTYPE_RADIOTAP = 127
+PCAP_HEADER_SIZE = 24
+MAX_PACKET_SIZE = 1 << 18
+
+RADIOTAP_HEADER = struct.Struct('<BBHI')
+RADIOTAP_EXT = 1 << 31
+RADIOTAP_FLAGS = 1
+RADIOTAP_CHANNEL = 3
+RADIOTAP_ANTSIGNAL = 5
+RADIOTAP_FLAG_FCS = 0x10
+# (alignment, size) of the radiotap fields preceding the antenna signal
+RADIOTAP_FIELDS = [(8, 8), (1, 1), (1, 1), (2, 4), (1, 2), (1, 1)]
+
+WLAN_HEADER_SIZE = 24
+PROBE_REQUEST = 0x40
+
+
+def parse_ek_record(line, ap):
+    data = json.loads(line)
+    epoch = data['layers']['frame']['frame_frame_time_epoch']
+    rssi = data['layers']['radiotap']['radiotap_radiotap_dbm_antsignal']
+    ssid = data['layers']['wlan'][0]['wlan_wlan_ta']
+    ie = data['layers']['wlan'][1]
+    frequency = data['layers']['radiotap'].get('radiotap_radiotap_channel_freq')
+    return {'ap': ap,
+            'epoch': int(float(epoch) * 1e9),
+            'rssi': int(rssi),
+            'ie': hashlib.md5(json.dumps(ie, sort_keys=True).encode()).hexdigest(),
+            'ssid': ssid,
+            'channel': frequency_to_channel(int(frequency)) if frequency else None
+            }
+
+
+def frequency_to_channel(frequency):
+    if frequency == 2484:
+        return 14
+    if 2412 <= frequency < 2484:
+        return (frequency - 2407) // 5
+    if 5950 < frequency <= 7115:
+        return (frequency - 5950) // 5
+    if 5000 < frequency < 5950:
+        return (frequency - 5000) // 5
+    return None
+
+
+def parse_radiotap(packet):
+    version, _, length, present = RADIOTAP_HEADER.unpack_from(packet)
+    offset = RADIOTAP_HEADER.size
+    extended = present
+    while extended & RADIOTAP_EXT:
+        extended, = struct.unpack_from('<I', packet, offset)
+        offset += 4
+    flags, frequency, rssi = 0, None, None
+    for field, (alignment, size) in enumerate(RADIOTAP_FIELDS):
+        if not present & (1 << field):
+            continue
+        offset += -offset % alignment
+        if field == RADIOTAP_FLAGS:
+            flags = packet[offset]
+        elif field == RADIOTAP_CHANNEL:
+            frequency = struct.unpack_from('<H', packet, offset)[0]
+        elif field == RADIOTAP_ANTSIGNAL:
+            rssi = struct.unpack_from('<b', packet, offset)[0]
+        offset += size
+    return length, flags, frequency, rssi
+
+
+def parse_probe_request(packet, epoch, ap):
+    length, flags, frequency, rssi = parse_radiotap(packet)
+    end = len(packet) - 4 if flags & RADIOTAP_FLAG_FCS else len(packet)
+    if rssi is None or end - length < WLAN_HEADER_SIZE or packet[length] != PROBE_REQUEST:
+        return None
+    return {'ap': ap,
+            'epoch': epoch,
+            'rssi': rssi,
+            'ie': hashlib.md5(packet[length + WLAN_HEADER_SIZE:end]).hexdigest(),
+            'ssid': bytes(packet[length + 10:length + 16]).hex(':'),
+            'channel': frequency_to_channel(frequency) if frequency else None
+            }
+
+
+class PcapStreamParser:
+
+    def __init__(self, ap):
+        self.ap = ap
+        self.buffer = bytearray()
+        self.record_header = None
+        self.resolution = 1000
+
+    def read_file_header(self):
+        magic = self.buffer[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            order = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            order = '>'
+        else:
+            raise ValueError('Not a pcap stream, pcapng is not supported')
+        self.resolution = 1 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1000
+        linktype, = struct.unpack_from(order + 'I', self.buffer, 20)
+        if linktype != LINKTYPE_RADIOTAP:
+            raise ValueError('Expected radiotap headers, got link type {}'.format(linktype))
+        self.record_header = struct.Struct(order + 'IIII')
+        del self.buffer[:PCAP_HEADER_SIZE]
+
+    def feed(self, data):
+        self.buffer += data
+        if self.record_header is None:
+            if len(self.buffer) < PCAP_HEADER_SIZE:
+                return []
+            self.read_file_header()
+        header = self.record_header
+        records = []
+        view = memoryview(self.buffer)
+        offset = 0
+        try:
+            while len(self.buffer) - offset >= header.size:
+                seconds, fraction, captured, _ = header.unpack_from(self.buffer, offset)
+                if captured > MAX_PACKET_SIZE:
+                    raise ValueError('Packet of {} bytes exceeds the maximum packet size'.format(captured))
+                end = offset + header.size + captured
+                if end > len(self.buffer):
+                    break
+                try:
+                    record = parse_probe_request(view[offset + header.size:end], seconds * 1000000000 + fraction * self.resolution, self.ap)
+                except (struct.error, IndexError):
+                    record = None
+                if record is not None:
+                    records.append(record)
+                offset = end
+        finally:
+            view.release()
+        del self.buffer[:offset]
+        return records
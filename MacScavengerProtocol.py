@@ -0,0 +1,156 @@
+import json
+import struct
+import time
+import zlib
+from threading import Event, Lock, Thread
+
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct('>IB')
+
+FRAME_HELLO = 0
+FRAME_RECORD = 1
+FRAME_BATCH = 2
+FRAME_BATCH_ZLIB = 3
+FRAME_STATS = 4
+
+COMPRESSIONS = ('none', 'zlib')
+COMPRESSION_LEVEL = 1
+
+MAX_FRAME_SIZE = 64 << 20
+
+
+def parse_command(data):
+    command, *options = data.split()
+    return command, dict(option.split('=', 1) for option in options if '=' in option)
+
+
+def encode_frame(kind, payload):
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def encode_hello(version=PROTOCOL_VERSION, **options):
+    return encode_frame(FRAME_HELLO, json.dumps(dict(options, version=version, clock=time.time_ns())).encode())
+
+
+def encode_stats(stats):
+    return encode_frame(FRAME_STATS, json.dumps(dict(stats, clock=time.time_ns())).encode())
+
+
+def encode_record(record):
+    return encode_frame(FRAME_RECORD, json.dumps(record).encode())
+
+
+def encode_batch(records, compression='none'):
+    payload = json.dumps(records).encode()
+    if compression == 'zlib':
+        return encode_frame(FRAME_BATCH_ZLIB, zlib.compress(payload, COMPRESSION_LEVEL))
+    return encode_frame(FRAME_BATCH, payload)
+
+
+class RecordBatcher:
+
+    def __init__(self, send, batch_size=1, latency_in_ms=0, compression='none'):
+        self.send = send
+        self.latency = latency_in_ms / 1000
+        self.batch_size = max(1, batch_size) if self.latency > 0 else 1
+        self.compression = compression
+        self.pending = []
+        self.oldest = None
+        self.error = None
+        self.lock = Lock()
+        self.closed = Event()
+        self.flusher = None
+        if self.batch_size > 1:
+            self.flusher = Thread(target=self._flush_periodically, daemon=True)
+            self.flusher.start()
+
+    def add(self, record):
+        if self.error:
+            raise self.error
+        with self.lock:
+            if not self.pending:
+                self.oldest = time.monotonic()
+            self.pending.append(record)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.closed.set()
+        if self.flusher:
+            self.flusher.join()
+        if self.error is None:
+            self.flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        if self.batch_size == 1:
+            self.send(encode_record(records[0]))
+        else:
+            self.send(encode_batch(records, self.compression))
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.latency / 4):
+            try:
+                with self.lock:
+                    if self.pending and time.monotonic() - self.oldest >= self.latency:
+                        self._flush()
+            except OSError as e:
+                self.error = e
+                return
+
+
+class FrameDecoder:
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        view = memoryview(self.buffer)
+        offset = 0
+        try:
+            while len(self.buffer) - offset >= HEADER.size:
+                length, kind = HEADER.unpack_from(self.buffer, offset)
+                if length > MAX_FRAME_SIZE:
+                    raise ValueError('Frame of {} bytes exceeds the maximum frame size'.format(length))
+                end = offset + HEADER.size + length
+                if end > len(self.buffer):
+                    break
+                frames.append((kind, view[offset + HEADER.size:end]))
+                offset = end
+            frames = [(kind, bytes(payload)) for kind, payload in frames]
+        finally:
+            view.release()
+        del self.buffer[:offset]
+        return frames
+
+
+def decode_records(frames):
+    records, hello, singles = [], None, []
+    for kind, payload in frames:
+        if kind == FRAME_RECORD:
+            singles.append(payload)
+            continue
+        if singles:
+            records.extend(json.loads(b'[' + b','.join(singles) + b']'))
+            singles = []
+        if kind == FRAME_BATCH:
+            records.extend(json.loads(payload))
+        elif kind == FRAME_BATCH_ZLIB:
+            records.extend(json.loads(zlib.decompress(payload)))
+        elif kind == FRAME_HELLO:
+            hello = json.loads(payload)
+        elif kind == FRAME_STATS:
+            continue
+        else:
+            raise ValueError('Unknown frame kind {}'.format(kind))
+    if singles:
+        records.extend(json.loads(b'[' + b','.join(singles) + b']'))
+    return records, hello
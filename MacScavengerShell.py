@@ -1,14 +1,17 @@
+import argparse
 import ast
-import json
+import glob
 import os
+import shlex
 import time
 from cmd import Cmd
 
 import yaml
 
 from MacScavengerAnalyzer import ScavengerAnalyzer
+from MacScavengerCaptureFormat import CAPTURE_EXTENSION
+from MacScavengerProtocol import COMPRESSIONS
 from MacScavengerSync import Swarm, CaptureDevice
-from pymongo.errors import ServerSelectionTimeoutError
 try:
     import readline
 except ImportError:
@@ -107,6 +110,114 @@ class ScavengerShell(Cmd):
     def help_start(self):
         print('Starts the data gathering process')
 
+    def do_format(self, inp):
+        if inp in ('json', 'npz'):
+            self.swarm.capture_format = inp
+        elif inp:
+            print('*** Unknown capture format {}. Choose json or npz'.format(inp))
+            return
+        print('Captures are stored as {}'.format(self.swarm.capture_format))
+
+    def help_format(self):
+        print('Sets the file format of stored captures: json (default) or npz (compact columnar NumPy format)')
+
+    def do_batching(self, inp):
+        input_split = inp.split()
+        if input_split == ['off']:
+            self.swarm.set_batching(1, 0, 'none')
+        elif input_split:
+            try:
+                batch_size, latency_in_ms = int(input_split[0]), int(input_split[1])
+                compression = input_split[2] if len(input_split) > 2 else 'none'
+            except (IndexError, ValueError):
+                print('*** Command must follow order: Size Latency [Compression]')
+                return
+            if compression not in COMPRESSIONS or batch_size < 1 or latency_in_ms < 0:
+                print('*** Invalid batching {}. Compression must be one of {}'.format(inp, ', '.join(COMPRESSIONS)))
+                return
+            if batch_size > 1 and latency_in_ms == 0:
+                print('*** A latency of 0 ms would hold records until {} have been captured, use a positive latency or a size of 1'.format(batch_size))
+                return
+            self.swarm.set_batching(batch_size, latency_in_ms, compression)
+        print('Monitors send up to {} records every {} ms (compression: {})'.format(
+            self.swarm.batch_size, self.swarm.batch_latency_in_ms, self.swarm.compression))
+
+    def help_batching(self):
+        print('Sets how monitors batch records before transmitting: batching Size Latency [none|zlib], or batching off. '
+              'Applies to the next start and only to monitors speaking the framed protocol')
+
+    def do_spool(self, inp):
+        if inp == 'off':
+            self.swarm.spool_in_mb = 0
+        elif inp:
+            try:
+                spool_in_mb = int(inp)
+            except ValueError:
+                print('*** {} is not a valid spool size'.format(inp))
+                return
+            if spool_in_mb < 0:
+                print('*** {} is not a valid spool size'.format(inp))
+                return
+            self.swarm.spool_in_mb = spool_in_mb
+        if self.swarm.spool_in_mb:
+            print('Monitors spool up to {} MB of records on disk'.format(self.swarm.spool_in_mb))
+        else:
+            print('Monitors do not spool records')
+
+    def help_spool(self):
+        print('Sets the disk budget in MB of the spool monitors keep records in until the sync acknowledges them, '
+              'so that a reconnect resumes where it left off: spool Size, or spool off. Applies to the next start')
+
+    def do_parser(self, inp):
+        if inp in ('ek', 'pcap'):
+            self.swarm.parser = inp
+        elif inp:
+            print('*** Unknown parser {}. Choose ek or pcap'.format(inp))
+            return
+        print('Monitors parse probe requests with {}'.format(self.swarm.parser))
+
+    def help_parser(self):
+        print('Sets how monitors parse probe requests: pcap (default, reads raw radiotap frames from tshark) or ek '
+              '(tshark JSON, as older monitors do). IE fingerprints differ between the two, so use one parser for all nodes')
+
+    def do_channels(self, inp):
+        if inp in ('adaptive', 'fixed'):
+            self.swarm.adaptive_channels = inp == 'adaptive'
+            if inp == 'fixed':
+                self.swarm.planner.plan_evenly()
+        elif inp:
+            print('*** Unknown channel mode {}. Choose adaptive or fixed'.format(inp))
+            return
+        print('Channel hopping is {}'.format('adaptive' if self.swarm.adaptive_channels else 'fixed'))
+        print(self.swarm.get_channel_overview())
+
+    def help_channels(self):
+        print('Prints the probe requests heard per channel and the dwell time scheduled for it. '
+              'channels adaptive (default) lets the swarm weight dwell times by these yields, channels fixed hops evenly')
+
+    def do_clock(self, inp):
+        input_split = inp.split()
+        if len(input_split) != 2:
+            print('*** Command must follow order: Name Offset, with the offset in ms or auto')
+            return
+        device = self.swarm.does_exist(input_split[0])
+        if not device:
+            print('No Device with name {} found'.format(input_split[0]))
+            return
+        if input_split[1] == 'auto':
+            device.clock_offset_in_ms = None
+        else:
+            try:
+                device.clock_offset_in_ms = float(input_split[1])
+            except ValueError:
+                print('*** {} is not a valid clock offset'.format(input_split[1]))
+                return
+        print('Clock offset of "{}": {:.1f} ms'.format(device.name, device.clock_offset() / 1e6))
+
+    def help_clock(self):
+        print('Sets the offset in ms added to the timestamps of a monitoring device to align its clock with the sync: '
+              'clock Name Offset. clock Name auto (default) estimates it from the clock readings the device sends')
+
     def do_add(self, inp):
         input_split = inp.split()
         if len(input_split) != 3:
@@ -145,7 +256,26 @@ class ScavengerShell(Cmd):
     def help_rm(self):
         print('Removes a specified monitoring device from the list.')
 
-    def do_analyze(self, inp):
+    def parse_analyze_arguments(self, inp):
+        parser = argparse.ArgumentParser(prog='analyze', add_help=False)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--backend', choices=['memory', 'mongo'], default='memory')
+        parser.add_argument('--snapshot', default=None)
+        parser.add_argument('--multistart', choices=['fixed', 'adaptive'], default='fixed')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--profile', action='store_true')
+        parser.add_argument('--metrics', default=None)
+        try:
+            arguments = parser.parse_args(shlex.split(inp))
+        except SystemExit:
+            return None
+        if arguments.workers < 1:
+            print('*** The number of workers must be at least 1')
+            return None
+        return arguments
+
+    def ask_ap_positions(self):
+
         def parse_ap_position(ap_positions):
             try:
                 parsed_pos = ast.literal_eval(ap_positions)
@@ -153,47 +283,32 @@ class ScavengerShell(Cmd):
             except:
                 return None
 
-        def is_data_source_valid(data_source):
-            def is_file_valid(file_content):
-                if len(file_content) > 0:
-                    for piece in file_content:
-                        if sorted(piece.keys()) == ['ap', 'epoch', 'ie', 'rssi', 'ssid']:
-                            pass
-                        else:
-                            return False
-                    return True
-                else:
-                    return False
-
-            if os.path.isfile(data_source):
-                with open(data_source,'r') as in_:
-                    data = json.load(in_)
-                    if is_file_valid(data):
-                        return True
-                    else:
-                        return False
-            if os.path.isdir(data_source):
-                for root, dirs, files in os.walk(data_source):
-                    for file in files:
-                        with open(os.path.join(root,file), 'r') as in_:
-                            data = json.load(in_)
-                            if is_file_valid(data):
-                                pass
-                            else:
-                                return False
-                    return True
-
         while True:
             ap_positions = input('Please enter Access Point Positons in the following form {"ap1":(0,0), "ap2":(5,0),"ap3":(5,5),"ap4":(0,5)}\n')
             parsed_ap_positions = parse_ap_position(ap_positions)
             if parsed_ap_positions:
-                break
+                return parsed_ap_positions
             else:
                 print('Unknown Format - Please try again! \n')
+
+    def do_analyze(self, inp):
+        arguments = self.parse_analyze_arguments(inp)
+        if not arguments:
+            return
+
+        def is_data_source_valid(data_source):
+            if os.path.isfile(data_source):
+                return data_source.endswith(('.json', CAPTURE_EXTENSION))
+            if os.path.isdir(data_source):
+                return len(glob.glob(os.path.join(data_source, '*.json')) + glob.glob(os.path.join(data_source, '*' + CAPTURE_EXTENSION))) > 0
+            return False
+
+        parsed_ap_positions = self.ask_ap_positions()
         try:
-            analyzer = ScavengerAnalyzer(parsed_ap_positions)
-        except ServerSelectionTimeoutError as e:
-            print('No MongoDB instance: {}'.format(e))
+            analyzer = ScavengerAnalyzer(parsed_ap_positions, workers=arguments.workers, backend=arguments.backend, snapshot_path=arguments.snapshot, multistart=arguments.multistart, seed=arguments.seed,
+                                          profile=arguments.profile or arguments.metrics is not None)
+        except ConnectionError as e:
+            print(e)
             return
         analyzer_config = analyzer.get_config()
         print('Analyzer has the following Configuration:')
@@ -201,7 +316,9 @@ class ScavengerShell(Cmd):
               '- Assumed Walking Speed in km/h: {1}\n'
               '- In Burst Time Threshold in seconds: {2}\n'
               '- Min. AP detection Rate: {3}\n'
-              '- Verbosity: {4}'
+              '- Verbosity: {4}\n'
+              '- Localization Workers: {5}\n'
+              '- Multi-start Localization: {6}'
               .format(*analyzer_config)
               )
         while True:
@@ -234,7 +351,7 @@ class ScavengerShell(Cmd):
                     print('The specified data source is a valid file')
                     break
                 else:
-                    print('The specified data source is a non-valid file')
+                    print('The specified data source is not a capture file')
                     continue
             elif os.path.isdir(abs_data_path):
                 if not os.listdir(abs_data_path):
@@ -246,7 +363,7 @@ class ScavengerShell(Cmd):
                         is_dir = True
                         break
                     else:
-                        print('The specified data source is a non-valid directory. Might contain elements in the wrong format.')
+                        print('The specified data source is a non-valid directory. It does not contain any capture files.')
                         continue
             else:
                 continue
@@ -256,13 +373,112 @@ class ScavengerShell(Cmd):
         try:
             analyzer.start(abs_data_path,is_dir)
             analyzer.summary()
+            if arguments.profile:
+                print(analyzer.metrics.report())
+            if arguments.metrics:
+                analyzer.metrics.export(arguments.metrics)
         except ValueError as e:
-            print('Error in Analysis Process: {}'.format(e), '\nPossibly the timestamps of the data are too far apart')
+            print('Error in Analysis Process: {}'.format(e))
 
 
 
     def help_analyze(self):
-        print('Start data analysis process.')
+        print('Start data analysis process.\n'
+              'Options:\n'
+              '  --workers N               Localize intervals in a pool of N processes (default 1)\n'
+              '  --backend {memory,mongo}  Keep the analysis state in memory (default) or in MongoDB\n'
+              '  --snapshot PATH           Write the analysis state to a JSON file when the analysis is done\n'
+              '  --multistart MODE         fixed: 20 random starting points per device (default)\n'
+              '                            adaptive: start from the RSSI-weighted centroid and the last known location,\n'
+              '                            add random starting points only while they find better minima\n'
+              '  --seed N                  Draw the starting points from a generator seeded with N, so repeated\n'
+              '                            analyses of the same capture give the same results for any number of workers\n'
+              '  --profile                 Print the time, calls and rows of every pipeline stage after the analysis\n'
+              '  --metrics PATH            Write the stage metrics as JSON to PATH after the analysis')
+
+    def parse_live_arguments(self, inp):
+        parser = argparse.ArgumentParser(prog='live', add_help=False)
+        parser.add_argument('--interval', type=float, default=5)
+        parser.add_argument('--lateness', type=float, default=2)
+        parser.add_argument('--queue-size', type=int, default=64)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--backend', choices=['memory', 'mongo'], default='memory')
+        parser.add_argument('--snapshot', default=None)
+        parser.add_argument('--seed', type=int, default=None)
+        try:
+            arguments = parser.parse_args(shlex.split(inp))
+        except SystemExit:
+            return None
+        if arguments.workers < 1 or arguments.queue_size < 1:
+            print('*** The number of workers and the queue size must be at least 1')
+            return None
+        return arguments
+
+    def do_live(self, inp):
+        arguments = self.parse_live_arguments(inp)
+        if not arguments:
+            return
+        if not self.swarm.device_list:
+            print('No devices registered')
+            return
+        parsed_ap_positions = self.ask_ap_positions()
+        try:
+            analyzer = ScavengerAnalyzer(parsed_ap_positions, time_interval_in_s=arguments.interval, allowed_lateness_in_s=arguments.lateness, workers=arguments.workers,
+                                          backend=arguments.backend, snapshot_path=arguments.snapshot, seed=arguments.seed)
+        except ConnectionError as e:
+            print(e)
+            return
+        analyzer.start_live(arguments.queue_size)
+        self.swarm.capture_and_fetch(analyzer.feed)
+        print('Analyzing live, press Ctrl+C to stop')
+        try:
+            while analyzer.live_thread.is_alive():
+                (unqiue_ids, uniquely_seen_ids, non_randomizing_devices, randomizing_devices), queued, latest, late = analyzer.live_status()
+                print('\033[K{0} devices, {1} seen once, {2} randomizing, {3} not randomizing | {4} batches queued | {5} late records dropped | latest verdict {6}'
+                      .format(unqiue_ids, uniquely_seen_ids, randomizing_devices, non_randomizing_devices, queued, late, 'pending' if latest is None else 'for probes {:.1f} s ago'.format(latest)))
+                print('\033[2A')
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print('\n')
+        self.swarm.stop_capture()
+        try:
+            analyzer.stop_live()
+            analyzer.summary()
+        except ValueError as e:
+            print('Error in Analysis Process: {}'.format(e))
+
+    def help_live(self):
+        print('Starts the data gathering process and analyzes the stream of all monitoring devices while it runs.\n'
+              'A running summary is shown until Ctrl+C stops capture and analysis. Captures are still stored as usual.\n'
+              'Options:\n'
+              '  --interval S              Interval size in seconds (default 5)\n'
+              '  --lateness S              Seconds to wait for late records before an interval is analyzed (default 2)\n'
+              '  --queue-size N            Batches of records buffered for the analysis before capture is slowed down (default 64)\n'
+              '  --workers, --backend, --snapshot, --seed   As for analyze')
+
+    def do_multistart(self, inp):
+        data_path = os.path.abspath(inp or './json_data/total_data.json')
+        if not (os.path.isfile(data_path) or os.path.isdir(data_path)):
+            print('*** No such capture file or directory: {}'.format(data_path))
+            return
+        analyzer = ScavengerAnalyzer(self.ask_ap_positions())
+        print('Localizing all intervals of {} with every multi-start mode ...'.format(data_path))
+        try:
+            amount_of_devices, comparison = analyzer.compare_multistart(data_path, os.path.isdir(data_path))
+        except ValueError as e:
+            print('Error in Analysis Process: {}'.format(e))
+            return
+        print('{} device localizations per mode'.format(amount_of_devices))
+        print('{0:<18}{1:>20}{2:>24}'.format('Mode', 'Localizations/s', 'Region Agreement'))
+        for name, rate, agreement in comparison:
+            print('{0:<18}{1:>20.1f}{2:>23.1f}%'.format(name, rate, 100 * agreement))
+
+    def help_multistart(self):
+        print('Compares the fixed and the adaptive multi-start localization on a capture file or directory\n'
+              '(default: json_data/total_data.json). Reports localizations per second and the share of devices\n'
+              'whose regions overlap with those of the fixed mode. "fixed (repeated)" shows how much two runs\n'
+              'of the random fixed mode agree with each other.')
 
 
 if __name__ == '__main__':
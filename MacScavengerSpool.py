@@ -0,0 +1,129 @@
+import os
+from pathlib import Path
+from threading import Condition
+
+from MacScavengerProtocol import HEADER
+
+SEGMENT_SUFFIX = '.spool'
+
+
+def complete_frames_length(data):
+    offset = 0
+    while len(data) - offset >= HEADER.size:
+        length, _ = HEADER.unpack_from(data, offset)
+        if offset + HEADER.size + length > len(data):
+            break
+        offset += HEADER.size + length
+    return offset
+
+
+class Spool:
+
+    def __init__(self, directory, budget_in_bytes=256 << 20, segment_size=4 << 20):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.budget = budget_in_bytes
+        self.segment_size = min(segment_size, max(1, budget_in_bytes // 4))
+        self.condition = Condition()
+        self.capturing = False
+        self.dropped = 0
+        self.segments = sorted(int(path.stem) for path in self.directory.glob('*' + SEGMENT_SUFFIX))
+        if self.segments:
+            self.end = self.segments[-1] + self._truncate_partial_frame(self.segments[-1])
+        else:
+            self.segments = [0]
+            self.end = 0
+        self.acked = max(self.segments[0], min(self._read_ack(), self.end))
+        self.out = open(self._path(self.segments[-1]), 'ab')
+
+    def _path(self, start):
+        return self.directory / '{:020d}{}'.format(start, SEGMENT_SUFFIX)
+
+    def _read_ack(self):
+        try:
+            return int((self.directory / 'ack').read_text())
+        except (OSError, ValueError):
+            return 0
+
+    def _truncate_partial_frame(self, start):
+        with open(self._path(start), 'r+b') as segment:
+            offset = complete_frames_length(segment.read())
+            segment.truncate(offset)
+        return offset
+
+    def size(self):
+        return self.end - self.segments[0]
+
+    def start_capture(self):
+        with self.condition:
+            self.capturing = True
+
+    def stop_capture(self):
+        with self.condition:
+            self.capturing = False
+            self.condition.notify_all()
+
+    def append(self, frames):
+        with self.condition:
+            if self.end - self.segments[-1] >= self.segment_size:
+                self.out.close()
+                self.segments.append(self.end)
+                self.out = open(self._path(self.end), 'ab')
+            self.out.write(frames)
+            self.out.flush()
+            self.end += len(frames)
+            while len(self.segments) > 1 and self.size() > self.budget:
+                dropped = max(0, self.segments[1] - max(self.acked, self.segments[0]))
+                if dropped:
+                    self.dropped += dropped
+                    print('Spool exceeds its budget, dropped {} unacknowledged bytes'.format(dropped))
+                self._remove_oldest()
+            self.acked = max(self.acked, self.segments[0])
+            self.condition.notify_all()
+
+    def acknowledge(self, offset):
+        with self.condition:
+            if not self.acked < offset <= self.end:
+                return
+            self.acked = offset
+            while len(self.segments) > 1 and self.segments[1] <= offset:
+                self._remove_oldest()
+            (self.directory / 'ack').write_text(str(offset))
+
+    def _remove_oldest(self):
+        os.remove(self._path(self.segments.pop(0)))
+
+    def resume_offset(self, offset=None):
+        with self.condition:
+            if offset is None or not self.segments[0] <= offset <= self.end:
+                return self.acked
+            return offset
+
+    def read(self, offset, size, timeout=1):
+        with self.condition:
+            if offset >= self.end and self.capturing:
+                self.condition.wait(timeout)
+            offset = max(offset, self.segments[0])
+            if offset >= self.end:
+                return offset, b'', self.capturing
+            index = max(i for i, start in enumerate(self.segments) if start <= offset)
+            start = self.segments[index]
+            stop = self.segments[index + 1] if index + 1 < len(self.segments) else self.end
+            path = self._path(start)
+        try:
+            with open(path, 'rb') as segment:
+                segment.seek(offset - start)
+                data = segment.read(min(size, stop - offset))
+                length = complete_frames_length(data)
+                if length == 0:
+                    segment.seek(offset - start)
+                    data = segment.read(HEADER.size + HEADER.unpack_from(data)[0])
+                else:
+                    data = data[:length]
+        except FileNotFoundError:
+            return offset, b'', True
+        return offset, data, True
+
+    def close(self):
+        with self.condition:
+            self.out.close()
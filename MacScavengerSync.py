@@ -1,26 +1,59 @@
 import ast
+import asyncio
+import codecs
+import json
 import re
 import socket
 import time
 import warnings
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import termtables as tt
-from streamz import Stream
+
+from MacScavengerChannels import ChannelPlanner, ChannelSchedule
+from MacScavengerMerge import WatermarkMerger
+from MacScavengerProtocol import FRAME_HELLO, FRAME_STATS, HEADER, PROTOCOL_VERSION, FrameDecoder, decode_records
 
 warnings.filterwarnings("ignore")
 #from SyncDataBaseInterfaces import AWS
 from SyncDataBaseInterfaces import Local
 
+LEGACY_REPLY = b'Unknown command'
+# legacy monitors send float(epoch) * 10e9, ten times the nanoseconds of the framed protocol
+LEGACY_EPOCH_SCALE = 10
+
+
+class LegacyMonitorError(Exception):
+    pass
+
+
 class Swarm:
     def __init__(self):
         self.device_list = []
-        self.threads = []
-        self.streams = []
+        self.loop = None
+        self.loop_thread = None
+        self.tasks = []
+        self.window = []
+        self.late_window = []
+        self.window_in_s = 20
+        self.allowed_lateness_in_s = 5
+        self.merge_interval_in_s = 1
+        self.merger = WatermarkMerger(self.allowed_lateness_in_s)
+        self.consumer = None
+        self.consumer_executor = None
+        self.batch_size = 100
+        self.batch_latency_in_ms = 250
+        self.compression = 'zlib'
+        self.parser = 'pcap'
+        self.spool_in_mb = 256
+        self.planner = ChannelPlanner()
+        self.adaptive_channels = True
+        self.channel_interval_in_s = 30
         self.last_stub = {}
-        self.q = deque(maxlen=1)
         self.database = None
+        self.capture_format = 'json'
         #self.database = AWS.SyncDataBaseAWS()
 
     def setup_devices(self):
@@ -77,36 +110,118 @@ class Swarm:
         else:
             pass
 
-    def capture_and_fetch(self):
-        if not self.database:
-            self.database = Local.SyncDataBaseLocal()
-        self.q.append(True)
-        for device in self.device_list:
-            source = Stream(asynchronous=False)
-            thread = Thread(target=device.capture_and_fetch, args=(source, self.q,))
-            thread.start()
-            self.threads.append(thread)
+    def capture_and_fetch(self, consumer=None):
+        if not self.database or isinstance(self.database, Local.SyncDataBaseLocal) and self.database.capture_format != self.capture_format:
+            self.database = Local.SyncDataBaseLocal(self.capture_format)
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
         print('Connecting to Devices ...', end='')
-        time.sleep(5)
-        streams = []
+        asyncio.run_coroutine_threadsafe(self.start_tasks(consumer), self.loop).result()
+        print(' Finished')
+
+    def set_batching(self, batch_size, latency_in_ms, compression):
+        self.batch_size = batch_size
+        self.batch_latency_in_ms = latency_in_ms
+        self.compression = compression
+
+    async def start_tasks(self, consumer):
+        self.window = []
+        self.late_window = []
+        self.merger = WatermarkMerger(self.allowed_lateness_in_s, [device.name for device in self.device_list])
+        self.consumer = consumer
+        self.consumer_executor = ThreadPoolExecutor(max_workers=1)
         for device in self.device_list:
-            streams.append(device.stream)
+            device.batch_size = self.batch_size
+            device.batch_latency_in_ms = self.batch_latency_in_ms
+            device.compression = self.compression
+            device.parser = self.parser
+            device.spool_in_mb = self.spool_in_mb
+            device.schedule = self.planner.schedule
+            device.unwritten = deque()
+        self.tasks = [asyncio.ensure_future(device.capture(self.deliver_to(device))) for device in self.device_list]
+        self.tasks.append(asyncio.ensure_future(self.write_windows()))
+        self.tasks.append(asyncio.ensure_future(self.advance_watermark()))
+        self.tasks.append(asyncio.ensure_future(self.plan_channels()))
 
-        if len(streams) == 1:
-            streams[0].timed_window(20).sink(self.write_to_database)
-        else:
-            streams[0]. \
-                union(*streams[1:]). \
-                timed_window(20).sink(self.write_to_database)
-        print(' Finished')
+    async def plan_channels(self):
+        while True:
+            await asyncio.sleep(self.channel_interval_in_s)
+            yields = {}
+            for device in self.device_list:
+                for channel, (records, dwell) in device.take_channel_yield().items():
+                    total = yields.setdefault(channel, [0, 0.0])
+                    total[0] += records
+                    total[1] += dwell
+            self.planner.update(yields)
+            schedule = self.planner.plan(time.time()) if self.adaptive_channels else self.planner.schedule
+            for device in self.device_list:
+                device.send_schedule(schedule)
+
+    def get_channel_overview(self):
+        return tt.to_string(
+            self.planner.report(),
+            header=['Channel', 'Probes', 'Dwell (s)', 'Probes/s', 'Scheduled Dwell (s)'],
+            style=tt.styles.ascii_thin_double,
+        )
+
+    def deliver_to(self, device):
+
+        async def deliver(records):
+            clock_offset = device.clock_offset()
+            merged, late = self.merger.push(device.name, records, clock_offset)
+            if device.offset is not None:
+                device.unwritten.append((device.offset, max(record['epoch'] for record in records) + clock_offset))
+            self.late_window.extend(late)
+            await self.release(merged)
+        return deliver
+
+    async def release(self, records):
+        if records:
+            self.window.extend(records)
+            if self.consumer:
+                await asyncio.get_running_loop().run_in_executor(self.consumer_executor, self.consumer, records)
+
+    async def advance_watermark(self):
+        while True:
+            await asyncio.sleep(self.merge_interval_in_s)
+            await self.release(self.merger.advance(time.time_ns()))
+
+    async def write_windows(self):
+        while True:
+            await asyncio.sleep(self.window_in_s)
+            await self.write_window()
+
+    async def write_window(self):
+        released = [(device, device.released_offset(self.merger.watermark)) for device in self.device_list]
+        window, self.window = self.window, []
+        late, self.late_window = self.late_window, []
+        for data in (window, late):
+            if data:
+                await asyncio.get_running_loop().run_in_executor(None, self.write_to_database, data)
+        for device, offset in released:
+            if offset is not None:
+                device.written = offset
+                device.acknowledge()
+
+    async def stop_tasks(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.release(self.merger.flush())
+        self.consumer_executor.shutdown()
+        await self.write_window()
+        await asyncio.gather(*[device.stop_monitor() for device in self.device_list])
 
     def stop_capture(self):
         print('Stopping Devices ...', end='')
-        self.q.append(False)
-        for thread in self.threads:
-            thread.join()
-        for device in self.device_list:
-            device.stop_process()
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(self.stop_tasks(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop, self.loop_thread = None, None
         print(' Finished')
 
     def get_swarm_overview(self):
@@ -116,14 +231,15 @@ class Swarm:
                 dev_on_retr = device.online
             else:
                 dev_on_retr = str(device.online) + '(Retries {})'.format(device.retries)
-            data.append([device.name, device.host, device.port, device.set_up, dev_on_retr, device.monitoring, device.total_data_packets])
+            data.append([device.name, device.host, device.port, device.set_up, dev_on_retr, device.monitoring, device.get_protocol(),
+                         round(device.clock_offset() / 1e6, 1), self.merger.late_records.get(device.name, 0), device.total_data_packets])
         if len(data) == 0:
             return None
         table = tt.to_string(
             data,
-            header=["Name", "Host", "Port", "Setup", "Alive", "Monitoring", "Data Transmitted"],
+            header=["Name", "Host", "Port", "Setup", "Alive", "Monitoring", "Protocol", "Clock Offset (ms)", "Late", "Data Transmitted"],
             padding=(0, 1),
-            alignment="ccccccc"
+            alignment="cccccccccc"
         )
         return table
 
@@ -135,14 +251,38 @@ class CaptureDevice:
         self.port = port
         self.total_data_packets = 0
         self.last_stub = ''
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.frames = FrameDecoder()
+        self.handshake = None
+        self.protocol = None
+        self.batch_size = 1
+        self.batch_latency_in_ms = 0
+        self.compression = 'none'
+        self.parser = 'ek'
+        self.active_parser = None
+        self.spool_in_mb = 0
+        self.offset = None
+        self.unwritten = deque()
+        self.written = None
+        self.acked = None
+        self.writer = None
+        self.hello_received = False
+        self.schedule = None
+        self.channel_stats = {}
+        self.channel_stats_taken = {}
+        self.clock_samples = deque(maxlen=12)
+        self.clock_offset_in_ms = None
         self.multipath_stub = []
-        self.stream = None
-        self.source = None
 
         self.set_up = False
         self.online = False
         self.monitoring = False
         self.retries = 0
+        self.read_size = 65536
+        self.receive_buffer_size = 1 << 20
+        self.connect_timeout_in_s = 5
+        self.initial_backoff_in_s = 0.5
+        self.max_backoff_in_s = 30
         # self.setup_ap()
 
     def remove_multipath_fading(self, data):
@@ -160,76 +300,181 @@ class CaptureDevice:
         #     return filtered
 
     def put_together_stubs(self, new_data):
-        rx = r'(\{[^{}]+\})'
-        all_data = self.last_stub + str(new_data, 'utf-8')
-        matches = re.findall(rx, all_data)
-        rest_data = all_data
-        for match in matches:
-            rest_data = rest_data.replace(match, '')
-        parsed_matches = [ast.literal_eval(match) for match in matches]
-        self.last_stub = rest_data
-        return parsed_matches
+        all_data = self.last_stub + self.decoder.decode(new_data)
+        matches = list(re.finditer(r'\{[^{}]+\}', all_data))
+        if not matches:
+            self.last_stub = all_data
+            return []
+        self.last_stub = all_data[matches[-1].end():]
+        return json.loads('[' + ','.join(match.group() for match in matches) + ']')
 
     def register_data_packets(self, x):
         self.total_data_packets += len(x)
         return x
 
-    def connect_device(self, run_on):
-        while run_on[0]:
+    def start_command(self):
+        if self.protocol == 1:
+            return 'start_monitor'
+        command = 'start_monitor proto={} batch={} latency={} compress={} parser={} spool={}'.format(
+            PROTOCOL_VERSION, self.batch_size, self.batch_latency_in_ms, self.compression, self.parser, self.spool_in_mb)
+        if self.spool_in_mb and self.offset is not None:
+            command += ' resume={}'.format(self.offset)
+        return command
+
+    def read_control_frames(self, frames):
+        for kind, payload in frames:
+            if kind == FRAME_HELLO:
+                hello = json.loads(payload)
+                self.offset = hello.get('offset')
+                self.sample_clock(hello)
+            elif kind == FRAME_STATS:
+                stats = json.loads(payload)
+                self.channel_stats = {int(channel): (yields['records'], yields['dwell']) for channel, yields in stats['channels'].items()}
+                self.sample_clock(stats)
+            elif self.offset is not None:
+                self.offset += HEADER.size + len(payload)
+
+    def sample_clock(self, control):
+        if 'clock' in control:
+            self.clock_samples.append(time.time_ns() - control['clock'])
+
+    def clock_offset(self):
+        if self.clock_offset_in_ms is not None:
+            return int(self.clock_offset_in_ms * 1e6)
+        if self.clock_samples:
+            return min(self.clock_samples)
+        return 0
+
+    def take_channel_yield(self):
+        yields = {}
+        for channel, (records, dwell) in self.channel_stats.items():
+            taken_records, taken_dwell = self.channel_stats_taken.get(channel, (0, 0.0))
+            if records < taken_records or dwell < taken_dwell:
+                taken_records, taken_dwell = 0, 0.0
+            yields[channel] = (records - taken_records, dwell - taken_dwell)
+        self.channel_stats_taken = self.channel_stats
+        return yields
+
+    def send_schedule(self, schedule):
+        self.schedule = schedule
+        if self.writer is not None and self.hello_received:
+            local_schedule = ChannelSchedule(schedule.channels, schedule.dwells, schedule.start - self.clock_offset() / 1e9)
+            self.writer.write(bytes(local_schedule.to_command() + '\n', "utf-8"))
+
+    def released_offset(self, watermark):
+        offset = None
+        while self.unwritten and watermark is not None and self.unwritten[0][1] <= watermark:
+            offset = self.unwritten.popleft()[0]
+        return offset
+
+    def acknowledge(self):
+        if self.writer is None or not self.hello_received or self.written is None or self.written == self.acked:
+            return
+        self.writer.write(bytes('ack offset={}\n'.format(self.written), "utf-8"))
+        self.acked = self.written
+
+    def get_protocol(self):
+        if self.protocol is None:
+            return '-'
+        return '{} ({})'.format(self.protocol, self.active_parser)
+
+    def use_parser(self, parser):
+        if parser != self.parser and parser != self.active_parser:
+            print('Warning: {} parses probe requests with {} instead of {}, its IE fingerprints only match nodes using the same parser'.format(
+                self.name, parser, self.parser))
+        self.active_parser = parser
+
+    def decode(self, data):
+        if self.protocol == 1:
+            records = self.put_together_stubs(data)
+            for record in records:
+                record['epoch'] = int(record['epoch'] / LEGACY_EPOCH_SCALE)
+            return records
+        if self.handshake is not None:
+            self.handshake += data
+            if len(self.handshake) < len(LEGACY_REPLY):
+                return []
+            if self.handshake.startswith(LEGACY_REPLY):
+                raise LegacyMonitorError(str(self.handshake, 'utf-8', 'replace'))
+            data, self.handshake = self.handshake, None
+        frames = self.frames.feed(data)
+        records, hello = decode_records(frames)
+        self.read_control_frames(frames)
+        if hello is not None:
+            self.hello_received = True
+            self.protocol = hello['version']
+            self.use_parser(hello.get('parser', 'ek'))
+            if self.schedule is not None:
+                self.send_schedule(self.schedule)
+            self.acknowledge()
+        return records
+
+    async def capture(self, deliver):
+        backoff = self.initial_backoff_in_s
+        while True:
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                    sock.connect((self.host, self.port))
-                    self.retries = 0
-                    sock.sendall(bytes('start_monitor', "utf-8"))
-                    continue_ = run_on[0]
-                    while continue_:
-                        data = sock.recv(1024)
-                        if not data:
-                            self.monitoring = False
-                            self.online = False
-                            break
-                        self.online = True
-                        self.monitoring = True
-                        self.source.emit(data)
-                        continue_ = run_on[0]
-                if run_on[0]:
-                    pass
-                else:
-                    self.monitoring = True
-                    break
-            except Exception as e:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, limit=self.read_size), self.connect_timeout_in_s)
+            except (OSError, asyncio.TimeoutError):
                 self.retries += 1
                 self.monitoring = False
                 self.online = False
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, self.max_backoff_in_s)
+                continue
+            self.retries = 0
+            self.last_stub = ''
+            self.decoder = codecs.getincrementaldecoder('utf-8')()
+            self.frames = FrameDecoder()
+            self.handshake = None if self.protocol == 1 else b''
+            self.hello_received = False
+            self.acked = None
+            try:
+                writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+                writer.write(bytes(self.start_command() + '\n', "utf-8"))
+                await writer.drain()
+                self.writer = writer
+                while True:
+                    data = await reader.read(self.read_size)
+                    if not data:
+                        break
+                    self.online = True
+                    self.monitoring = True
+                    records = self.register_data_packets(self.remove_multipath_fading(self.decode(data)))
+                    backoff = self.initial_backoff_in_s
+                    if records:
+                        await deliver(records)
+            except LegacyMonitorError:
+                self.protocol = 1
+                self.use_parser('ek')
+                continue
+            except OSError:
                 pass
+            except Exception as e:
+                print('Reconnecting to {0} after an unreadable stream: {1!r}'.format(self.name, e))
+            finally:
+                self.writer = None
+                self.monitoring = False
+                self.online = False
+                writer.close()
+            await asyncio.sleep(backoff)
+            backoff = min(2 * backoff, self.max_backoff_in_s)
 
-    def capture_and_fetch(self, source, run_on):
-        self.stream = source. \
-            map(lambda x: self.put_together_stubs(x)). \
-            flatten(). \
-            timed_window(1). \
-            map(lambda x: self.remove_multipath_fading(x)). \
-            map(lambda x: self.register_data_packets(x)). \
-            flatten()
-
-        self.source = source
-
-        self.connect_device(run_on)
-
-    def stop_process(self):
+    async def stop_monitor(self):
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.connect((self.host, self.port))
-                sock.sendall(bytes('stop_monitor', "utf-8"))
-                data = sock.recv(1024)
-                received = str(data, "utf-8")
-                if received == '0':
-                    self.online = True
-                    self.monitoring = False
-                elif received == '1':
-                    self.online = True
-                    self.monitoring = True
-        except Exception as e:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout_in_s)
+            try:
+                writer.write(bytes('stop_monitor', "utf-8"))
+                data = await asyncio.wait_for(reader.read(1024), self.connect_timeout_in_s)
+            finally:
+                writer.close()
+            received = str(data, "utf-8")
+            if received == '0':
+                self.online = True
+                self.monitoring = False
+            elif received == '1':
+                self.online = True
+                self.monitoring = True
+        except (OSError, asyncio.TimeoutError) as e:
             self.online = False
             self.monitoring = False
 
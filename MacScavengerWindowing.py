@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+
+class IntervalWindower:
+    def __init__(self, interval_in_s, allowed_lateness_in_s=0):
+        self.interval = int(interval_in_s * 1e9)
+        self.allowed_lateness = int(allowed_lateness_in_s * 1e9)
+        self.origin = None
+        self.watermark = None
+        self.next_window = None
+        self.open_windows = {}
+        self.late_records = 0
+
+    def push(self, data_frame):
+        if len(data_frame) == 0:
+            return []
+        epochs = data_frame['epoch'].values.astype('datetime64[ns]').view('int64')
+        if self.origin is None:
+            self.origin = int(epochs[0])
+        windows = (epochs - self.origin) // self.interval
+        if self.next_window is not None:
+            on_time = windows >= self.next_window
+            self.late_records += int(len(windows) - np.count_nonzero(on_time))
+            data_frame, epochs, windows = data_frame[on_time], epochs[on_time], windows[on_time]
+        if len(windows) > 0:
+            if np.all(windows[1:] >= windows[:-1]):
+                starts = np.append(0, np.flatnonzero(np.diff(windows)) + 1)
+                ends = np.append(starts[1:], len(windows))
+                for start, end in zip(starts, ends):
+                    self.open_windows.setdefault(int(windows[start]), []).append(data_frame.iloc[start:end])
+            else:
+                order = np.argsort(windows, kind='stable')
+                distinct_windows, starts = np.unique(windows[order], return_index=True)
+                ends = np.append(starts[1:], len(order))
+                for window, start, end in zip(distinct_windows, starts, ends):
+                    self.open_windows.setdefault(int(window), []).append(data_frame.iloc[order[start:end]])
+            watermark = int(epochs.max()) - self.allowed_lateness
+            self.watermark = watermark if self.watermark is None else max(self.watermark, watermark)
+        closable = (self.watermark - self.origin) // self.interval if self.watermark is not None else None
+        return self._close([window for window in sorted(self.open_windows) if closable is not None and window < closable])
+
+    def advance(self, watermark):
+        if self.origin is None:
+            return []
+        self.watermark = watermark if self.watermark is None else max(self.watermark, watermark)
+        closable = (self.watermark - self.origin) // self.interval
+        return self._close([window for window in sorted(self.open_windows) if window < closable])
+
+    def flush(self):
+        return self._close(sorted(self.open_windows))
+
+    def _close(self, windows):
+        closed = []
+        for window in windows:
+            closed.append(pd.concat(self.open_windows.pop(window)).reset_index(drop=True))
+            self.next_window = window + 1
+        return closed
@@ -0,0 +1,62 @@
+import json
+
+from StateStoreInterfaces.StateStoreBaseClass import StateStoreBaseclass
+
+
+class StateStoreMemory(StateStoreBaseclass):
+    def __init__(self):
+        super().__init__()
+        self.registry = {}
+        self.latest_by_ie = {}
+        self.latest_by_ie_ssid = {}
+        self.summary = {}
+
+    def get_latest_appearance_ie_ssid(self, ie, ssid):
+        timestamp = self.latest_by_ie_ssid.get((ie, ssid))
+        if timestamp is None:
+            return None
+        return self._appearance(ie, ssid, timestamp)
+
+    def get_latest_appearance_ie(self, ie):
+        latest = self.latest_by_ie.get(ie)
+        if latest is None:
+            return None
+        return self._appearance(ie, *latest)
+
+    def add_region(self, ie, ssid, timestamp, region):
+        self.registry.setdefault(ie, {}).setdefault(ssid, {}).setdefault(timestamp, []).append(region)
+        if (ie, ssid) not in self.latest_by_ie_ssid or timestamp > self.latest_by_ie_ssid[(ie, ssid)]:
+            self.latest_by_ie_ssid[(ie, ssid)] = timestamp
+        if ie not in self.latest_by_ie or timestamp > self.latest_by_ie[ie][1]:
+            self.latest_by_ie[ie] = (ssid, timestamp)
+
+    def increase_seen_count(self, ssid):
+        entry = self.summary.setdefault(ssid, {})
+        entry['seen'] = entry.get('seen', 0) + 1
+
+    def add_alias(self, ssid, alias):
+        aliases = self.summary.setdefault(ssid, {}).setdefault('alias', [])
+        if alias not in aliases:
+            aliases.append(alias)
+
+    def count_ssids(self):
+        return len(self.summary)
+
+    def count_seen_multiple_times(self):
+        return sum(1 for entry in self.summary.values() if entry.get('seen', 0) > 1)
+
+    def count_with_alias(self):
+        return sum(1 for entry in self.summary.values() if 'alias' in entry)
+
+    def snapshot(self, path):
+        registry = [
+            {'ie': ie, 'ssid': ssid, 'timestamp': timestamp, 'regions': regions}
+            for ie, ssids in self.registry.items() for ssid, timestamps in ssids.items() for timestamp, regions in timestamps.items()
+        ]
+        registry.sort(key=lambda document: document['timestamp'])
+        summary = [dict(entry, ssid=ssid) for ssid, entry in self.summary.items()]
+        with open(path, 'w+') as out_:
+            json.dump({'ie-ssid-registry': registry, 'summary': summary}, out_)
+
+    def _appearance(self, ie, ssid, timestamp):
+        return {'ssid': ssid, 'timestamp': timestamp, 'regions': self.registry[ie][ssid][timestamp]}
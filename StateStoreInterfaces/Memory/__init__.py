@@ -0,0 +1 @@
+from .StateStoreMemory import StateStoreMemory
\ No newline at end of file
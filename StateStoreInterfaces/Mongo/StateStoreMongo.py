@@ -0,0 +1,163 @@
+import time
+
+from StateStoreInterfaces.StateStoreBaseClass import StateStoreBaseclass
+
+
+class StateStoreMongo(StateStoreBaseclass):
+    def __init__(self):
+        super().__init__()
+        from pymongo import MongoClient, UpdateOne
+        from pymongo.errors import ServerSelectionTimeoutError
+        client = MongoClient(serverSelectionTimeoutMS=2000)
+        try:
+            client.server_info()
+        except ServerSelectionTimeoutError as e:
+            raise ConnectionError('No MongoDB instance: {}'.format(e))
+        db = client.mac_scavenger_db
+        self.db_state_handle = db['ie-ssid-registry-v2-{}'.format(time.time_ns())]
+        self.db_summary_handle = db['summary-{}'.format(time.time_ns())]
+        create_registry_indexes(self.db_state_handle)
+        create_summary_indexes(self.db_summary_handle)
+        self.update_operation = UpdateOne
+        self.pending_regions = {}
+        self.pending_summary = {}
+
+    def get_latest_appearance_ie_ssid(self, ie, ssid):
+        search, sort = find_latest_ie_ssid(ie, ssid)
+        document = self.db_state_handle.find_one(search, sort=sort)
+        stored = to_appearance(document) if document else None
+        buffered = None
+        buffered_timestamps = self.pending_regions.get(ie, {}).get(ssid)
+        if buffered_timestamps:
+            latest_timestamp = max(buffered_timestamps.keys())
+            buffered = {'ssid': ssid, 'timestamp': latest_timestamp, 'regions': buffered_timestamps[latest_timestamp]}
+        return merge_appearances(stored, buffered)
+
+    def get_latest_appearance_ie(self, ie):
+        search, sort = find_latest_ie(ie)
+        document = self.db_state_handle.find_one(search, sort=sort)
+        stored = to_appearance(document) if document else None
+        buffered = None
+        buffered_ssids = self.pending_regions.get(ie)
+        if buffered_ssids:
+            latest_timestamp = max([max(v.keys()) for k, v in buffered_ssids.items()])
+            latest_ssid, latest_regions = [(k, v[latest_timestamp]) for k, v in buffered_ssids.items() if latest_timestamp in v.keys()][0]
+            buffered = {'ssid': latest_ssid, 'timestamp': latest_timestamp, 'regions': latest_regions}
+        return merge_appearances(stored, buffered)
+
+    def add_region(self, ie, ssid, timestamp, region):
+        self.pending_regions.setdefault(ie, {}).setdefault(ssid, {}).setdefault(timestamp, []).append(region)
+
+    def increase_seen_count(self, ssid):
+        entry = self.pending_summary.setdefault(ssid, {'seen': 0, 'alias': []})
+        entry['seen'] += 1
+
+    def add_alias(self, ssid, alias):
+        entry = self.pending_summary.setdefault(ssid, {'seen': 0, 'alias': []})
+        if alias not in entry['alias']:
+            entry['alias'].append(alias)
+
+    def flush(self):
+        if self.pending_regions:
+            operations = [
+                self.update_operation(*add_regions_to_ie_ssid_timestamp(ie, ssid, timestamp, regions), upsert=True)
+                for ie, ssids in self.pending_regions.items() for ssid, timestamps in ssids.items() for timestamp, regions in timestamps.items()
+            ]
+            self.db_state_handle.bulk_write(operations, ordered=False)
+            self.pending_regions = {}
+        if self.pending_summary:
+            operations = [self.update_operation(*update_summary_entry(ssid, entry['seen'], entry['alias']), upsert=True) for ssid, entry in self.pending_summary.items()]
+            self.db_summary_handle.bulk_write(operations, ordered=False)
+            self.pending_summary = {}
+
+    def count_ssids(self):
+        self.flush()
+        return self.db_summary_handle.estimated_document_count()
+
+    def count_seen_multiple_times(self):
+        self.flush()
+        return self.db_summary_handle.count_documents({'seen': {'$gt': 1}})
+
+    def count_with_alias(self):
+        self.flush()
+        return self.db_summary_handle.count_documents({'alias': {'$exists': True}})
+
+    def snapshot(self, path):
+        import json
+        self.flush()
+        registry = list(self.db_state_handle.find({}, {'_id': False}).sort([('timestamp', 1), ('_id', 1)]))
+        summary = list(self.db_summary_handle.find({}, {'_id': False}))
+        with open(path, 'w+') as out_:
+            json.dump({'ie-ssid-registry': registry, 'summary': summary}, out_)
+
+
+def create_registry_indexes(collection):
+    collection.create_index([('ie', 1), ('ssid', 1), ('timestamp', -1)], unique=True)
+    collection.create_index([('ie', 1), ('timestamp', -1), ('_id', 1)])
+
+
+def create_summary_indexes(collection):
+    collection.create_index([('ssid', 1)], unique=True)
+
+
+def migrate_registry(source, target, batch_size=1000):
+    from pymongo import UpdateOne
+    create_registry_indexes(target)
+    operations = []
+    migrated = 0
+    for document in source.find({}, sort=[('_id', 1)]):
+        for ssid, timestamps in document.items():
+            if ssid in ('_id', 'ie'):
+                continue
+            for timestamp, regions in timestamps.items():
+                operations.append(UpdateOne(*add_regions_to_ie_ssid_timestamp(document['ie'], ssid, int(timestamp), regions), upsert=True))
+        if len(operations) >= batch_size:
+            target.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+    if operations:
+        target.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+    return migrated
+
+
+def to_appearance(document):
+    return {'ssid': document['ssid'], 'timestamp': document['timestamp'], 'regions': document['regions']}
+
+
+def merge_appearances(stored, buffered):
+    if not stored or not buffered:
+        return stored or buffered
+    if stored['timestamp'] < buffered['timestamp']:
+        return buffered
+    if stored['timestamp'] > buffered['timestamp'] or stored['ssid'] != buffered['ssid']:
+        return stored
+    return {'ssid': stored['ssid'], 'timestamp': stored['timestamp'], 'regions': stored['regions'] + buffered['regions']}
+
+
+def find_latest_ie(ie):
+    FIND_LATEST_IE_SEARCH = {'ie': str(ie)}
+    FIND_LATEST_IE_SORT = [('timestamp', -1), ('_id', 1)]
+    return FIND_LATEST_IE_SEARCH, FIND_LATEST_IE_SORT
+
+
+def find_latest_ie_ssid(ie, ssid):
+    FIND_LATEST_IE_SSID_SEARCH = {'ie': str(ie), 'ssid': str(ssid)}
+    FIND_LATEST_IE_SSID_SORT = [('timestamp', -1)]
+    return FIND_LATEST_IE_SSID_SEARCH, FIND_LATEST_IE_SSID_SORT
+
+
+def add_regions_to_ie_ssid_timestamp(ie, ssid, timestamp, regions):
+    ADD_REGIONS_SEARCH = {'ie': str(ie), 'ssid': str(ssid), 'timestamp': timestamp}
+    ADD_REGIONS_PUSH = {'$push': {'regions': {'$each': regions}}}
+    return ADD_REGIONS_SEARCH, ADD_REGIONS_PUSH
+
+
+def update_summary_entry(ssid, seen, aliases):
+    UPDATE_SUMMARY_ENTRY_SEARCH = {'ssid': ssid}
+    UPDATE_SUMMARY_ENTRY_UPDATE = {}
+    if seen:
+        UPDATE_SUMMARY_ENTRY_UPDATE['$inc'] = {'seen': seen}
+    if aliases:
+        UPDATE_SUMMARY_ENTRY_UPDATE['$addToSet'] = {'alias': {'$each': aliases}}
+    return UPDATE_SUMMARY_ENTRY_SEARCH, UPDATE_SUMMARY_ENTRY_UPDATE
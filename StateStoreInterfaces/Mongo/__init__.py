@@ -0,0 +1 @@
+from .StateStoreMongo import StateStoreMongo
\ No newline at end of file
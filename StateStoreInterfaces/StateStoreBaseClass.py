@@ -0,0 +1,46 @@
+from abc import ABCMeta, abstractmethod
+
+
+class StateStoreBaseclass(metaclass=ABCMeta):
+
+    @abstractmethod
+    def __init__(self):
+        pass
+
+    @abstractmethod
+    def get_latest_appearance_ie_ssid(self, ie, ssid):
+        pass
+
+    @abstractmethod
+    def get_latest_appearance_ie(self, ie):
+        pass
+
+    @abstractmethod
+    def add_region(self, ie, ssid, timestamp, region):
+        pass
+
+    @abstractmethod
+    def increase_seen_count(self, ssid):
+        pass
+
+    @abstractmethod
+    def add_alias(self, ssid, alias):
+        pass
+
+    @abstractmethod
+    def count_ssids(self):
+        pass
+
+    @abstractmethod
+    def count_seen_multiple_times(self):
+        pass
+
+    @abstractmethod
+    def count_with_alias(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def snapshot(self, path):
+        raise NotImplementedError('{} does not support snapshots'.format(type(self).__name__))
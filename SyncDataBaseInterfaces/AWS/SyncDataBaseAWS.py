@@ -4,8 +4,9 @@ from SyncDataBaseInterfaces.SyncDataBaseBaseClass import SyncDataBaseBaseclass
 
 
 class SyncDataBaseAWS(SyncDataBaseBaseclass):
-    def __init__(self):
+    def __init__(self, capture_format='json'):
         super().__init__()
+        self.capture_format = capture_format
         import pandas as pd
         import boto3
         access_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'accessKeys.csv')
@@ -18,8 +19,13 @@ class SyncDataBaseAWS(SyncDataBaseBaseclass):
         import json
         from_ = min([data_['epoch'] for data_ in data])
         to_ = max([data_['epoch'] for data_ in data])
+        if self.capture_format == 'npz':
+            from MacScavengerCaptureFormat import capture_to_bytes
+            body = capture_to_bytes(data)
+        else:
+            body = json.dumps(data)
         self.s3.meta.client.put_object(
-            Body=json.dumps(data),
+            Body=body,
             Bucket='testbucketlenz',
-            Key='upload_folder/{0}-{1}.json'.format(from_, to_)
+            Key='upload_folder/{0}-{1}.{2}'.format(from_, to_, self.capture_format)
         )
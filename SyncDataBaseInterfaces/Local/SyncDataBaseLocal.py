@@ -4,12 +4,18 @@ from SyncDataBaseInterfaces.SyncDataBaseBaseClass import SyncDataBaseBaseclass
 
 
 class SyncDataBaseLocal(SyncDataBaseBaseclass):
-    def __init__(self):
+    def __init__(self, capture_format='json'):
         super().__init__()
+        self.capture_format = capture_format
 
     def write(self, data):
         import json
         from_ = min([data_['epoch'] for data_ in data])
         to_ = max([data_['epoch'] for data_ in data])
-        with open('{0}-{1}.json'.format(from_, to_),'a+') as out_:
-            json.dump(data,out_)
+        if self.capture_format == 'npz':
+            from MacScavengerCaptureFormat import write_capture
+            with open('{0}-{1}.npz'.format(from_, to_), 'wb') as out_:
+                write_capture(data, out_)
+        else:
+            with open('{0}-{1}.json'.format(from_, to_),'a+') as out_:
+                json.dump(data,out_)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from MacScavengerAnalyzer import ScavengerAnalyzer
+from MacScavengerWindowing import IntervalWindower
+from benchmarks.synthetic_capture import DEFAULT_AP_POSITIONS, generate_capture, write_synthetic_capture
+
+STAGES = ['load', 'interval split', 'hash', 'intersect', 'group', 'localize', 'interpret', 'store']
+
+
+class StageRecorder:
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.stages = OrderedDict((stage, {'calls': 0, 'rows': 0, 'seconds': 0.0, 'peak_bytes': 0}) for stage in STAGES)
+
+    def measure(self, stage, function, *args, rows=0):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - started
+        record = self.stages[stage]
+        record['calls'] += 1
+        record['rows'] += rows
+        record['seconds'] += elapsed
+        if self.trace_memory:
+            record['peak_bytes'] = max(record['peak_bytes'], tracemalloc.get_traced_memory()[1] - baseline)
+        return result
+
+
+def run_stages(path, recorder, seed):
+    analyzer = ScavengerAnalyzer(DEFAULT_AP_POSITIONS, seed=seed)
+    analyzer.windower = IntervalWindower(analyzer.time_interval_in_s, analyzer.allowed_lateness_in_s)
+    chunks = recorder.measure('load', list, analyzer._load_records(path))
+    recorder.stages['load']['rows'] = sum(len(chunk) for chunk in chunks)
+    windows = []
+    for chunk in chunks:
+        split = recorder.measure('interval split', lambda data_frame: analyzer.windower.push(analyzer._parse_timestamp(data_frame)), chunk, rows=len(chunk))
+        windows.extend(split)
+    windows.extend(recorder.measure('interval split', analyzer.windower.flush))
+    windows = [recorder.measure('hash', analyzer._create_hash, window, rows=len(window)) for window in windows]
+    windows = [recorder.measure('intersect', analyzer._intersect_overlapping, window, rows=len(window)) for window in windows]
+    intervals = [recorder.measure('group', analyzer._group_ies_and_ssids, window, rows=len(window)) for window in windows if window is not None]
+    for measurements in intervals:
+        localized = recorder.measure('localize', analyzer._localize, measurements, rows=len(measurements.rssi))
+        analyzer.running_median = measurements.running_median
+        interpreted = recorder.measure('interpret', analyzer._interpret_results, localized, rows=len(localized))
+        recorder.measure('store', analyzer._to_database, interpreted, rows=len(interpreted))
+
+
+def benchmark(scales, duration_in_s, capture_extension, trace_memory, seed):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for devices in scales:
+            path = os.path.join(directory, 'synthetic-{0}{1}'.format(devices, capture_extension))
+            write_synthetic_capture(path, generate_capture(devices, duration_in_s, fingerprints=max(1, devices // 3), seed=seed))
+            timing = StageRecorder(False)
+            run_stages(path, timing, seed)
+            if trace_memory:
+                memory = StageRecorder(True)
+                tracemalloc.start()
+                try:
+                    run_stages(path, memory, seed)
+                finally:
+                    tracemalloc.stop()
+                for stage, record in timing.stages.items():
+                    record['peak_bytes'] = memory.stages[stage]['peak_bytes']
+            for stage, record in timing.stages.items():
+                rate = record['rows'] / record['seconds'] if record['seconds'] else 0.0
+                results.append(dict(devices=devices, stage=stage, rows_per_s=rate, **record))
+    return results
+
+
+def print_results(results):
+    print('{0:>8} {1:<15}{2:>7}{3:>10}{4:>11}{5:>13}{6:>12}'.format('Devices', 'Stage', 'Calls', 'Rows', 'Seconds', 'Rows/s', 'Peak MiB'))
+    for result in results:
+        print('{devices:>8} {stage:<15}{calls:>7}{rows:>10}{seconds:>11.3f}{rows_per_s:>13.0f}{peak:>12.1f}'.format(peak=result['peak_bytes'] / 2 ** 20, **result))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the throughput and peak memory of every analyzer stage on synthetic captures of several sizes')
+    parser.add_argument('--scales', type=int, nargs='+', default=[25, 100, 400], help='Numbers of simulated devices')
+    parser.add_argument('--duration', type=float, default=300, help='Length of every synthetic capture in seconds')
+    parser.add_argument('--format', choices=['json', 'npz'], default='json', help='File format of the synthetic captures')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the second pass that traces the peak memory of every stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='Also write the results as JSON to this path, e.g. to compare them against a baseline')
+    arguments = parser.parse_args()
+    results = benchmark(arguments.scales, arguments.duration, '.' + arguments.format, not arguments.no_memory, arguments.seed)
+    print_results(results)
+    if arguments.out:
+        with open(arguments.out, 'w') as out_:
+            json.dump(results, out_, indent=2)
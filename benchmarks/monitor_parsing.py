@@ -0,0 +1,78 @@
+import argparse
+import io
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from MacScavengerPacket import LINKTYPE_RADIOTAP, PcapStreamParser, parse_ek_record
+
+RADIOTAP = struct.Struct('<BBHIBBHHb')
+
+
+def synthetic_probe_request(rng, mac, ies, rssi):
+    radiotap = RADIOTAP.pack(0, 0, RADIOTAP.size, 0b101110, 0, 2, 2412, 0x00a0, rssi)
+    header = struct.pack('<BBH6s6s6sH', 0x40, 0, 0, b'\xff' * 6, mac, b'\xff' * 6, rng.randrange(1 << 12) << 4)
+    return radiotap + header + ies
+
+
+def synthetic_ek_line(rng, mac, ies, rssi, epoch):
+    fields = {'wlan_wlan_tag_number': [ies[index] for index in range(0, min(len(ies), 40), 4)],
+              'wlan_wlan_supported_rates': ['1', '2', '5.5', '11', '6', '9', '12', '18'],
+              'wlan_wlan_ht_capabilities': '0x0000016e',
+              'wlan_wlan_extcap': ies[:8].hex()}
+    layers = {'frame': {'frame_frame_time_epoch': '{:.9f}'.format(epoch / 1e9), 'frame_frame_len': str(len(ies) + 48)},
+              'radiotap': {'radiotap_radiotap_version': '0', 'radiotap_radiotap_length': str(RADIOTAP.size),
+                           'radiotap_radiotap_channel_freq': '2412', 'radiotap_radiotap_dbm_antsignal': str(rssi)},
+              'wlan': [{'wlan_wlan_fc_type_subtype': '4', 'wlan_wlan_ta': mac.hex(':'), 'wlan_wlan_ra': 'ff:ff:ff:ff:ff:ff',
+                        'wlan_wlan_seq': str(rng.randrange(1 << 12))}, fields]}
+    return json.dumps({'timestamp': str(epoch // 1000000), 'layers': layers}) + '\n'
+
+
+def synthetic_capture(packets, seed):
+    rng = random.Random(seed)
+    fingerprints = [bytes(rng.randrange(256) for _ in range(rng.randint(60, 200))) for _ in range(50)]
+    pcap = io.BytesIO()
+    pcap.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_RADIOTAP))
+    lines = []
+    epoch = 1600000000 * 10 ** 9
+    for _ in range(packets):
+        epoch += rng.randint(1000, 10 ** 7)
+        mac, ies, rssi = bytes(rng.randrange(256) for _ in range(6)), rng.choice(fingerprints), rng.randint(-90, -30)
+        packet = synthetic_probe_request(rng, mac, ies, rssi)
+        pcap.write(struct.pack('<IIII', epoch // 10 ** 9, epoch % 10 ** 9 // 1000, len(packet), len(packet)))
+        pcap.write(packet)
+        lines.append(synthetic_ek_line(rng, mac, ies, rssi, epoch))
+    return pcap.getvalue(), lines
+
+
+def measure_ek(lines):
+    started = time.perf_counter()
+    parsed = [parse_ek_record(line, 'benchmark') for line in lines]
+    return len(parsed), time.perf_counter() - started
+
+
+def measure_pcap(capture, read_size):
+    parser = PcapStreamParser('benchmark')
+    started = time.perf_counter()
+    parsed = 0
+    for offset in range(0, len(capture), read_size):
+        parsed += len(parser.feed(capture[offset:offset + read_size]))
+    return parsed, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures how many probe requests per second a monitor node can parse with the ek and the pcap parser')
+    parser.add_argument('--packets', type=int, default=100000)
+    parser.add_argument('--read-size', type=int, default=65536, help='Bytes read from tshark at once in pcap mode')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    capture, lines = synthetic_capture(arguments.packets, arguments.seed)
+    print('{0:<8}{1:>10}{2:>11}{3:>13}{4:>11}'.format('Parser', 'Packets', 'Seconds', 'Packets/s', 'MiB in'))
+    for name, (packets, seconds), size in [('ek', measure_ek(lines), sum(map(len, lines))),
+                                           ('pcap', measure_pcap(capture, arguments.read_size), len(capture))]:
+        print('{0:<8}{1:>10}{2:>11.3f}{3:>13.0f}{4:>11.1f}'.format(name, packets, seconds, packets / seconds, size / 2 ** 20))
@@ -0,0 +1,109 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from MacScavengerCaptureFormat import CAPTURE_EXTENSION, write_capture
+
+DEFAULT_AP_POSITIONS = {'tinkerboard1': (0, 0), 'tinkerboard2': (8, 0), 'tinkerboard3': (8, 5), 'tinkerboard4': (0, 5)}
+
+
+class SyntheticDevice:
+
+    def __init__(self, rng, bounds, ie, randomizing, walking_speed_km_per_h):
+        self.rng = rng
+        self.bounds = bounds
+        self.ie = ie
+        self.randomizing = randomizing
+        self.speed = walking_speed_km_per_h / 3.6
+        self.mac = self.random_mac() if randomizing else self.vendor_mac()
+        self.position = rng.uniform(*bounds)
+        self.waypoint = rng.uniform(*bounds)
+
+    def vendor_mac(self):
+        return ':'.join('{:02x}'.format(octet) for octet in self.rng.integers(0, 256, 6) & np.array([0xfc, 255, 255, 255, 255, 255]))
+
+    def random_mac(self):
+        octets = self.rng.integers(0, 256, 6)
+        octets[0] = (octets[0] & 0xfc) | 0x02
+        return ':'.join('{:02x}'.format(octet) for octet in octets)
+
+    def move(self, seconds):
+        remaining = self.speed * seconds
+        while remaining > 0:
+            direction = self.waypoint - self.position
+            distance = np.linalg.norm(direction)
+            if distance <= remaining:
+                self.position, remaining = self.waypoint, remaining - distance
+                self.waypoint = self.rng.uniform(*self.bounds)
+            else:
+                self.position = self.position + direction / distance * remaining
+                remaining = 0
+
+    def probe_mac(self):
+        if self.randomizing:
+            self.mac = self.random_mac()
+        return self.mac
+
+
+def generate_capture(devices=100, duration_in_s=300, ap_positions=None, probe_interval_in_s=15, burst_size=3, randomizing_share=0.6,
+                     path_loss_exponent=2, noise_in_db=3, fingerprints=None, detection_range_in_m=15, walking_speed_km_per_h=2, start_epoch=1600000000, seed=0):
+    ap_positions = ap_positions or DEFAULT_AP_POSITIONS
+    rng = np.random.default_rng(seed)
+    names = list(ap_positions)
+    positions = np.array([ap_positions[name] for name in names], dtype=float)
+    bounds = (positions.min(axis=0), positions.max(axis=0))
+    ies = [hashlib.md5(rng.bytes(16)).hexdigest() for _ in range(fingerprints or devices)]
+    population = [SyntheticDevice(rng, bounds, ies[index % len(ies)], rng.random() < randomizing_share, walking_speed_km_per_h) for index in range(devices)]
+    next_burst = rng.uniform(0, probe_interval_in_s, devices)
+    records = []
+    for now in np.arange(0, duration_in_s, 1.0):
+        for index in np.flatnonzero(next_burst < now + 1):
+            device, mac = population[index], population[index].probe_mac()
+            distances = np.maximum(np.linalg.norm(positions - device.position, axis=1), 0.1)
+            heard = np.flatnonzero(distances <= detection_range_in_m)
+            for frame in range(burst_size):
+                epoch = int((start_epoch + next_burst[index] + frame * 0.02) * 1e9)
+                rssi = -(30 + 10 * path_loss_exponent * np.log10(distances)) + rng.normal(0, noise_in_db, len(names))
+                for ap in heard:
+                    records.append({'ap': names[ap], 'epoch': epoch, 'rssi': int(np.clip(np.round(rssi[ap]), -127, -1)), 'ie': device.ie, 'ssid': mac})
+            next_burst[index] += rng.exponential(probe_interval_in_s)
+        for device in population:
+            device.move(1.0)
+    records.sort(key=lambda record: record['epoch'])
+    return records
+
+
+def write_synthetic_capture(path, records):
+    if path.endswith(CAPTURE_EXTENSION):
+        with open(path, 'wb') as out_:
+            write_capture(records, out_)
+    else:
+        with open(path, 'w') as out_:
+            json.dump(records, out_)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a synthetic capture of devices probing while walking through the floor plan spanned by the APs')
+    parser.add_argument('out', help='Path of the capture, .json or ' + CAPTURE_EXTENSION)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=300, help='Length of the capture in seconds')
+    parser.add_argument('--aps', type=ast.literal_eval, default=DEFAULT_AP_POSITIONS, help='AP positions, e.g. "{\'ap1\': (0, 0), \'ap2\': (5, 0), \'ap3\': (5, 5)}"')
+    parser.add_argument('--probe-interval', type=float, default=15, help='Mean seconds between two probe bursts of a device')
+    parser.add_argument('--burst-size', type=int, default=3)
+    parser.add_argument('--randomizing-share', type=float, default=0.6, help='Share of devices using a new random MAC for every burst')
+    parser.add_argument('--path-loss-exponent', type=float, default=2)
+    parser.add_argument('--noise', type=float, default=3, help='Standard deviation of the RSSI noise in dB')
+    parser.add_argument('--fingerprints', type=int, default=None, help='Number of distinct IE fingerprints shared by the devices (default: one per device)')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    records = generate_capture(arguments.devices, arguments.duration, arguments.aps, arguments.probe_interval, arguments.burst_size, arguments.randomizing_share,
+                               arguments.path_loss_exponent, arguments.noise, arguments.fingerprints, seed=arguments.seed)
+    write_synthetic_capture(arguments.out, records)
+    print('Wrote {0} records of {1} devices to {2}'.format(len(records), arguments.devices, arguments.out))
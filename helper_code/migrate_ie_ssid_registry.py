@@ -0,0 +1,33 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from pymongo import MongoClient
+
+from StateStoreInterfaces.Mongo.StateStoreMongo import migrate_registry
+
+LEGACY_PREFIX = 'ie-ssid-registry-'
+MIGRATED_PREFIX = 'ie-ssid-registry-v2-'
+
+parser = argparse.ArgumentParser(description='Migrates ie-ssid registries from one document per IE to one document per IE, SSID and timestamp')
+parser.add_argument('collections', nargs='*', help='Names of the registry collections to migrate. All legacy registries if omitted.')
+parser.add_argument('--host', default='localhost')
+parser.add_argument('--port', type=int, default=27017)
+parser.add_argument('--database', default='mac_scavenger_db')
+parser.add_argument('--batch-size', type=int, default=1000)
+parser.add_argument('--drop', action='store_true', help='Drop the legacy collection after a successful migration')
+arguments = parser.parse_args()
+
+db = MongoClient(arguments.host, arguments.port, serverSelectionTimeoutMS=2000)[arguments.database]
+collections = arguments.collections or [
+    name for name in db.list_collection_names() if name.startswith(LEGACY_PREFIX) and not name.startswith(MIGRATED_PREFIX)
+]
+
+for name in collections:
+    target_name = MIGRATED_PREFIX + name[len(LEGACY_PREFIX):]
+    migrated = migrate_registry(db[name], db[target_name], arguments.batch_size)
+    print('Migrated {0} entries from {1} to {2}'.format(migrated, name, target_name))
+    if arguments.drop:
+        db[name].drop()
@@ -1,64 +1,133 @@
+import argparse
 import json
 import os
-from collections import defaultdict
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 
-parent_path = '/Users/holzmano/Dropbox/Studium/FS20/Masterthesis/Experiments/Experiment 3 - Messe/data'
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
-total_data = defaultdict(list)
+from MacScavengerCaptureFormat import CAPTURE_EXTENSION, iter_capture_chunks, write_capture
+from MacScavengerIngest import RECORD_KEYS, iter_record_chunks
 
-for root, dirs, files in os.walk(parent_path):
-    for dir in dirs:
-        for root_2, dirs_2, files_2 in os.walk(root + '/' + dir):
-            temp_count = 0
-            for file_2 in files_2:
-                if file_2.endswith('.json'):
-                    with open(root_2 + '/' + file_2, 'r') as file_:
-                        contents = json.load(file_)
-                        total_data[dir] += (contents)
-                        temp_count += len(contents)
-            print('Fetched {0} datapoints from {1} files in folder {2}'
-                  .format(temp_count, len(files_2), dir))
 
-all_dfs = {}
-min_data_stamps = []
-for name, data in total_data.items():
-    df = pd.DataFrame(data)
-    df['epoch'] = df['epoch'] * 1000
-    df['epoch'] = pd.to_datetime(df.epoch.astype(int), unit='ns')
-    df = df.sort_values('epoch')
-    min_data_stamps.append(min(df['epoch']))
-    df['epoch'] = df['epoch'].apply(lambda x: x.value)
-    all_dfs[name] = df
+def find_device_files(parent_path):
+    devices = {}
+    for device in sorted(os.listdir(parent_path)):
+        device_path = os.path.join(parent_path, device)
+        if not os.path.isdir(device_path):
+            continue
+        files = []
+        for root, dirs, names in os.walk(device_path):
+            files += [os.path.join(root, name) for name in names if name.endswith('.json') or name.endswith(CAPTURE_EXTENSION)]
+        devices[device] = sorted(files)
+    return devices
 
-all_dfs_ = []
-min_data_stamp = min(min_data_stamps).value
-for name, df in all_dfs.items():
-    diff = min(df['epoch']) - min_data_stamp
-    df['epoch'] = df['epoch'].apply(lambda x: x-diff)
-    all_dfs_.append(df)
 
-df_total = pd.concat(all_dfs_)
-df_total = df_total.sort_values('epoch')
+def write_sorted_run(task):
+    device, path, run_path, epoch_scale = task
+    chunks = iter_capture_chunks(path) if path.endswith(CAPTURE_EXTENSION) else iter_record_chunks(path)
+    try:
+        frame = pd.concat(list(chunks), ignore_index=True)
+    except ValueError as e:
+        print('Skipping {0}: {1}'.format(path, e))
+        return device, None, 0, None, None
+    epochs = frame['epoch'].to_numpy()
+    if epochs.dtype.kind == 'f':
+        epochs = np.round(epochs * epoch_scale).astype(np.int64)
+    else:
+        epochs = epochs.astype(np.int64) * epoch_scale
+    run = np.empty(len(frame), dtype=[('ap', str, max(1, frame['ap'].str.len().max())),
+                                      ('epoch', np.int64),
+                                      ('ie', str, max(1, frame['ie'].str.len().max())),
+                                      ('rssi', np.int64),
+                                      ('ssid', str, max(1, frame['ssid'].str.len().max()))])
+    for column in RECORD_KEYS:
+        run[column] = epochs if column == 'epoch' else frame[column].to_numpy()
+    run = run[np.argsort(run['epoch'], kind='stable')]
+    np.save(run_path, run)
+    return device, run_path, len(run), int(run['epoch'][0]), int(run['epoch'][-1])
 
-out_path = '../json_data'
 
-with open(out_path + '/total_data.json', 'w+') as out_:
-    json.dump(df_total.to_dict('records'), out_)
+def write_partition(task):
+    out_path, start, stop, runs, output_format = task
+    parts = []
+    for run_path, offset in runs:
+        run = np.load(run_path, mmap_mode='r')
+        epochs = run['epoch']
+        lower, upper = np.searchsorted(epochs, [start + offset, stop + offset])
+        if upper > lower:
+            part = pd.DataFrame(np.array(run[lower:upper]))
+            part['epoch'] -= offset
+            parts.append(part)
+    if not parts:
+        return out_path, 0
+    frame = pd.concat(parts, ignore_index=True).sort_values('epoch', kind='stable')
+    records = frame[RECORD_KEYS].to_dict('records')
+    if output_format == 'npz':
+        with open(out_path, 'wb') as out_:
+            write_capture(records, out_)
+    else:
+        with open(out_path, 'w') as out_:
+            json.dump(records, out_)
+    return out_path, len(records)
 
 
+def unite(parent_path, out_path, partition_in_s, align, epoch_scale, output_format, workers, temp_path):
+    devices = find_device_files(parent_path)
+    os.makedirs(out_path, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=temp_path) as temp_dir, ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = [(device, path, os.path.join(temp_dir, 'run-{}.npy'.format(index)), epoch_scale)
+                 for index, (device, path) in enumerate((device, path) for device, paths in devices.items() for path in paths)]
+        runs = {device: [] for device in devices}
+        for device, run_path, count, first, last in pool.map(write_sorted_run, tasks, chunksize=16):
+            if run_path is not None:
+                runs[device].append((run_path, count, first, last))
+        runs = {device: device_runs for device, device_runs in runs.items() if device_runs}
+        for device, device_runs in runs.items():
+            print('Fetched {0} datapoints from {1} files in folder {2}'.format(sum(run[1] for run in device_runs), len(device_runs), device))
+        if not runs:
+            print('No datapoints found in {}'.format(parent_path))
+            return 0
+        firsts = {device: min(run[2] for run in device_runs) for device, device_runs in runs.items()}
+        offsets = {device: first - min(firsts.values()) if align == 'first' else 0 for device, first in firsts.items()}
+        start = min(first - offsets[device] for device, first in firsts.items())
+        stop = max(run[3] - offsets[device] for device, device_runs in runs.items() for run in device_runs) + 1
+        partition = int(partition_in_s * 1e9)
+        boundaries = list(range(start, stop, partition))
+        width = max(6, len(str(len(boundaries))))
+        extension = CAPTURE_EXTENSION if output_format == 'npz' else '.json'
+        partitions = []
+        for index, lower in enumerate(boundaries):
+            upper = lower + partition
+            overlapping = [(run_path, offsets[device]) for device, device_runs in runs.items()
+                           for run_path, _, first, last in device_runs if first - offsets[device] < upper and last - offsets[device] >= lower]
+            name = '{0:0{width}d}-{1}-{2}{3}'.format(index, lower, upper, extension, width=width)
+            partitions.append((os.path.join(out_path, name), lower, upper, overlapping, output_format))
+        total = 0
+        for path, count in pool.map(write_partition, partitions):
+            if count == 0:
+                continue
+            total += count
+            print('Wrote {0} datapoints to {1}'.format(count, path))
+    print('Total {} datapoints'.format(total))
+    return total
 
-# previous_pointer = 0
-# pointer = previous_pointer
-# size_of_slices = 1000
-# count_ = 1
-# while True:
-#     with open(out_path+'/'+str(count_)+'.json','w+') as out_:
-#         sliced_df = df.iloc[previous_pointer:pointer+size_of_slices,:]
-#         json.dump(sliced_df.to_dict('records'),out_)
-#     previous_pointer = pointer
-#     pointer +=size_of_slices
-#     count_+=1
 
-print('Total {} datapoints'.format(len(total_data)))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Unites the captures of several monitoring devices, one folder per device, '
+                                                 'into time-partitioned files sorted by epoch that the analyzer can read one after another')
+    parser.add_argument('input', help='Folder containing one folder of .json or ' + CAPTURE_EXTENSION + ' captures per device')
+    parser.add_argument('output', help='Folder the partitions are written to')
+    parser.add_argument('--partition', type=float, default=300, help='Seconds of capture per output file')
+    parser.add_argument('--align', choices=['first', 'none'], default='first',
+                        help='first shifts the timestamps of every device so that its first datapoint coincides with the earliest one of all devices')
+    parser.add_argument('--epoch-scale', type=int, default=1, help='Factor converting the stored epochs to nanoseconds, e.g. 1000 for microseconds')
+    parser.add_argument('--format', choices=['json', 'npz'], default='json')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--tmp', default=None, help='Folder for the intermediate sorted runs (default: system temp folder)')
+    arguments = parser.parse_args()
+    unite(arguments.input, arguments.output, arguments.partition, arguments.align, arguments.epoch_scale, arguments.format, arguments.workers, arguments.tmp)
@@ -0,0 +1,53 @@
+from MacScavengerMerge import WatermarkMerger
+
+SECOND = int(1e9)
+
+
+def records(*epochs):
+    return [{'epoch': epoch} for epoch in epochs]
+
+
+def epochs(released):
+    return [record['epoch'] for record in released]
+
+
+def test_releases_in_epoch_order_once_every_source_reported():
+    merger = WatermarkMerger(5, sources=['a', 'b'])
+    assert merger.push('a', records(1, 4, 7)) == ([], [])
+    released, late = merger.push('b', records(2, 3, 5))
+    assert epochs(released) == [1, 2, 3, 4, 5]
+    assert late == []
+    assert epochs(merger.flush()) == [7]
+
+
+def test_silent_source_holds_back_for_the_allowed_lateness_only():
+    merger = WatermarkMerger(5, sources=['a', 'b'])
+    assert merger.push('a', records(1 * SECOND, 3 * SECOND)) == ([], [])
+    released, _ = merger.push('a', records(7 * SECOND))
+    assert epochs(released) == [1 * SECOND]
+    assert epochs(merger.advance(9 * SECOND)) == [3 * SECOND]
+
+
+def test_records_behind_the_watermark_are_late():
+    merger = WatermarkMerger(0, sources=['a', 'b'])
+    released = merger.push('a', records(10))[0] + merger.push('b', records(20))[0]
+    assert epochs(released) == [10, 20]
+    released, late = merger.push('b', records(5, 15, 25))
+    assert epochs(late) == [5, 15]
+    assert merger.late_records == {'b': 2}
+    assert epochs(released) == [25]
+
+
+def test_clock_offset_shifts_the_records_of_a_source():
+    merger = WatermarkMerger(5, sources=['a', 'b'])
+    merger.push('a', records(100, 200))
+    released, _ = merger.push('b', records(10, 110), clock_offset=100)
+    assert epochs(released + merger.flush()) == [100, 110, 200, 210]
+
+
+def test_out_of_order_batches_of_one_source_are_sorted():
+    merger = WatermarkMerger(5, sources=['a', 'b'])
+    merger.push('a', records(30, 10))
+    merger.push('a', records(20))
+    released, _ = merger.push('b', records(40))
+    assert epochs(released + merger.flush()) == [10, 20, 30, 40]
@@ -0,0 +1,45 @@
+import json
+import struct
+
+from MacScavengerChannels import ChannelHopper
+from MacScavengerPacket import frequency_to_channel, parse_ek_record, parse_probe_request
+
+RADIOTAP = struct.Struct('<BBHIBBHHb')
+
+
+def probe_request(frequency, rssi=-50):
+    radiotap = RADIOTAP.pack(0, 0, RADIOTAP.size, 0b101110, 0, 2, frequency, 0x00a0, rssi)
+    header = struct.pack('<BBH6s6s6sH', 0x40, 0, 0, b'\xff' * 6, bytes(range(6)), b'\xff' * 6, 0)
+    return radiotap + header + b'\x00\x04test'
+
+
+def test_frequency_to_channel():
+    assert [frequency_to_channel(frequency) for frequency in (2412, 2437, 2472, 2484)] == [1, 6, 13, 14]
+    assert [frequency_to_channel(frequency) for frequency in (5180, 5825, 5955)] == [36, 165, 1]
+    assert frequency_to_channel(900) is None
+
+
+def test_probe_request_carries_the_radiotap_channel():
+    record = parse_probe_request(probe_request(2442), 1, 'ap')
+    assert record['channel'] == 7
+    assert record['rssi'] == -50
+    assert record['ssid'] == '00:01:02:03:04:05'
+
+
+def test_ek_record_carries_the_radiotap_channel():
+    layers = {'frame': {'frame_frame_time_epoch': '1.5'},
+              'radiotap': {'radiotap_radiotap_dbm_antsignal': '-60', 'radiotap_radiotap_channel_freq': '2462'},
+              'wlan': [{'wlan_wlan_ta': 'aa:bb:cc:dd:ee:ff'}, {}]}
+    assert parse_ek_record(json.dumps({'layers': layers}), 'ap')['channel'] == 11
+    del layers['radiotap']['radiotap_radiotap_channel_freq']
+    assert parse_ek_record(json.dumps({'layers': layers}), 'ap')['channel'] is None
+
+
+def test_hopper_counts_by_the_channel_a_probe_was_heard_on():
+    hopper = ChannelHopper()
+    hopper.channel = 1
+    hopper.yields[1] = [0, 0.0]
+    record = hopper.count({'epoch': 1, 'channel': 5})
+    assert 'channel' not in record
+    hopper.count({'epoch': 2, 'channel': None})
+    assert hopper.stats() == {1: {'records': 1, 'dwell': 0.0}, 5: {'records': 1, 'dwell': 0.0}}
@@ -0,0 +1,61 @@
+import zlib
+
+import pytest
+
+from MacScavengerProtocol import (FRAME_BATCH_ZLIB, FRAME_HELLO, FRAME_RECORD, HEADER, MAX_FRAME_SIZE, FrameDecoder, RecordBatcher,
+                                  decode_records, encode_batch, encode_frame, encode_hello, encode_record)
+
+RECORDS = [{'ap': 'ap{}'.format(i), 'epoch': i, 'ie': 'ie', 'rssi': -40 - i, 'ssid': 'ssid'} for i in range(10)]
+
+
+def test_frames_split_at_every_byte_are_reassembled():
+    stream = encode_hello(name='node') + b''.join(encode_record(record) for record in RECORDS[:3]) + encode_batch(RECORDS[3:], 'zlib')
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(len(stream)):
+        frames += decoder.feed(stream[i:i + 1])
+    assert [kind for kind, _ in frames] == [FRAME_HELLO, FRAME_RECORD, FRAME_RECORD, FRAME_RECORD, FRAME_BATCH_ZLIB]
+    records, hello = decode_records(frames)
+    assert records == RECORDS
+    assert hello['name'] == 'node'
+    assert not decoder.buffer
+
+
+def test_partial_frame_is_kept_until_complete():
+    frame = encode_record(RECORDS[0])
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:HEADER.size + 1]) == []
+    assert decoder.feed(frame[HEADER.size + 1:] + frame[:2]) == [(FRAME_RECORD, frame[HEADER.size:])]
+    assert bytes(decoder.buffer) == frame[:2]
+
+
+def test_oversized_frame_is_rejected():
+    with pytest.raises(ValueError):
+        FrameDecoder().feed(HEADER.pack(MAX_FRAME_SIZE + 1, FRAME_RECORD))
+
+
+def test_corrupt_and_unknown_frames_raise():
+    with pytest.raises(zlib.error):
+        decode_records([(FRAME_BATCH_ZLIB, b'garbage')])
+    with pytest.raises(ValueError):
+        decode_records([(42, b'')])
+    with pytest.raises(ValueError):
+        decode_records(FrameDecoder().feed(encode_frame(FRAME_RECORD, b'{not json')))
+
+
+def test_batcher_flushes_on_size_and_close():
+    sent = []
+    batcher = RecordBatcher(sent.append, 4, 60000, 'zlib')
+    for record in RECORDS:
+        batcher.add(record)
+    assert len(sent) == 2
+    batcher.close()
+    assert decode_records(FrameDecoder().feed(b''.join(sent)))[0] == RECORDS
+
+
+def test_batcher_without_latency_sends_every_record():
+    sent = []
+    batcher = RecordBatcher(sent.append, 100, 0)
+    batcher.add(RECORDS[0])
+    assert sent == [encode_record(RECORDS[0])]
+    batcher.close()
@@ -0,0 +1,140 @@
+from MacScavengerProtocol import HEADER, encode_batch, encode_record
+from MacScavengerSpool import Spool, complete_frames_length
+
+
+def frames(first, count):
+    return b''.join(encode_record({'epoch': epoch}) for epoch in range(first, first + count))
+
+
+def append_one_by_one(spool, first, count):
+    for epoch in range(first, first + count):
+        spool.append(encode_record({'epoch': epoch}))
+    return frames(first, count)
+
+
+def read_all(spool, offset):
+    first, data = None, b''
+    while True:
+        start, chunk, _ = spool.read(offset, 1 << 20, timeout=0)
+        if not chunk:
+            return start if first is None else first, data
+        if first is None:
+            first = start
+        data += chunk
+        offset = start + len(chunk)
+
+
+def test_complete_frames_length_stops_before_a_partial_frame():
+    data = frames(0, 3)
+    assert complete_frames_length(data) == len(data)
+    assert complete_frames_length(data + data[:HEADER.size + 2]) == len(data)
+    assert complete_frames_length(data[:HEADER.size - 1]) == 0
+
+
+def test_read_returns_appended_frames_from_any_frame_offset(tmp_path):
+    spool = Spool(tmp_path, segment_size=64)
+    data = append_one_by_one(spool, 0, 20)
+    assert read_all(spool, 0) == (0, data)
+    second = len(encode_record({'epoch': 0}))
+    assert read_all(spool, second) == (second, data[second:])
+    assert len(spool.segments) > 1
+    spool.close()
+
+
+def test_read_never_splits_a_frame(tmp_path):
+    spool = Spool(tmp_path)
+    batch = encode_batch([{'epoch': epoch} for epoch in range(50)])
+    spool.append(batch + batch)
+    start, data, _ = spool.read(0, len(batch) + 1, timeout=0)
+    assert (start, data) == (0, batch)
+    start, data, _ = spool.read(0, 5, timeout=0)
+    assert (start, data) == (0, batch)
+    spool.close()
+
+
+def test_acknowledge_removes_acknowledged_segments_and_survives_a_restart(tmp_path):
+    spool = Spool(tmp_path, segment_size=64)
+    data = append_one_by_one(spool, 0, 20)
+    acked = complete_frames_length(data[:len(data) // 2])
+    spool.acknowledge(acked)
+    assert spool.segments[0] <= acked
+    assert spool.segments[1] > acked
+    spool.acknowledge(acked - 1)
+    assert spool.acked == acked
+    spool.close()
+
+    reopened = Spool(tmp_path, segment_size=64)
+    assert reopened.acked == acked
+    assert reopened.end == len(data)
+    assert reopened.resume_offset() == acked
+    assert read_all(reopened, reopened.resume_offset()) == (acked, data[acked:])
+    reopened.close()
+
+
+def test_restart_truncates_a_partially_written_frame(tmp_path):
+    spool = Spool(tmp_path)
+    data = frames(0, 5)
+    spool.append(data)
+    spool.out.write(frames(5, 1)[:-3])
+    spool.out.flush()
+    spool.close()
+
+    reopened = Spool(tmp_path)
+    assert reopened.end == len(data)
+    assert read_all(reopened, 0) == (0, data)
+    more = frames(5, 2)
+    reopened.append(more)
+    assert read_all(reopened, 0) == (0, data + more)
+    reopened.close()
+
+
+def test_resume_offset_falls_back_to_the_acknowledged_offset(tmp_path):
+    spool = Spool(tmp_path, segment_size=64)
+    data = append_one_by_one(spool, 0, 20)
+    acked = complete_frames_length(data[:len(data) // 2])
+    spool.acknowledge(acked)
+    assert spool.resume_offset(len(data)) == len(data)
+    assert spool.resume_offset(len(data) + 1) == acked
+    assert spool.resume_offset(0) == acked
+    assert spool.resume_offset(None) == acked
+    spool.close()
+
+
+def test_ack_file_beyond_the_spool_is_clamped(tmp_path):
+    spool = Spool(tmp_path)
+    spool.append(frames(0, 3))
+    spool.close()
+    (tmp_path / 'ack').write_text('999999')
+    reopened = Spool(tmp_path)
+    assert reopened.acked == reopened.end
+    reopened.close()
+    (tmp_path / 'ack').write_text('garbage')
+    reopened = Spool(tmp_path)
+    assert reopened.acked == 0
+    reopened.close()
+
+
+def test_over_budget_drops_the_oldest_segments(tmp_path, capsys):
+    frame_size = len(encode_record({'epoch': 0}))
+    spool = Spool(tmp_path, budget_in_bytes=8 * frame_size, segment_size=2 * frame_size)
+    for epoch in range(40):
+        spool.append(encode_record({'epoch': epoch}))
+    assert spool.size() <= spool.budget
+    assert spool.dropped > 0
+    assert 'dropped' in capsys.readouterr().out
+    assert spool.acked == spool.segments[0]
+    assert len(list(tmp_path.glob('*.spool'))) == len(spool.segments)
+    start, data = read_all(spool, 0)
+    assert start == spool.segments[0]
+    assert data == frames(40 - len(data) // frame_size, len(data) // frame_size)
+    spool.close()
+
+
+def test_acknowledged_bytes_do_not_count_as_dropped(tmp_path):
+    frame_size = len(encode_record({'epoch': 0}))
+    spool = Spool(tmp_path, budget_in_bytes=8 * frame_size, segment_size=2 * frame_size)
+    for epoch in range(40):
+        spool.append(encode_record({'epoch': epoch}))
+        spool.acknowledge(spool.end)
+    assert spool.dropped == 0
+    spool.close()
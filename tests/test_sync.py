@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+
+from MacScavengerChannels import ChannelSchedule
+from MacScavengerProtocol import encode_batch, encode_hello, parse_command
+from MacScavengerSpool import Spool
+from MacScavengerSync import CaptureDevice, Swarm
+
+SECOND = int(1e9)
+
+
+def records(ap, epochs):
+    return [{'ap': ap, 'epoch': epoch, 'ie': 'ie', 'rssi': -50, 'ssid': 'aa:bb:cc:dd:ee:ff'} for epoch in epochs]
+
+
+async def legacy_monitor(reader, writer, epochs):
+    command = (await reader.read(1024)).strip()
+    if command != b'start_monitor':
+        writer.write(b'Unknown command ' + command)
+    else:
+        for record in records('legacy', epochs):
+            writer.write(json.dumps(dict(record, epoch=record['epoch'] / 1e9 * 10e9)).encode())
+            await writer.drain()
+            await asyncio.sleep(0.001)
+        await reader.read()
+    writer.close()
+
+
+async def framed_monitor(reader, writer, epochs):
+    await reader.read(1024)
+    writer.write(encode_hello(name='framed', parser='pcap'))
+    for record in records('framed', epochs):
+        writer.write(encode_batch([record]))
+        await writer.drain()
+        await asyncio.sleep(0.001)
+    await reader.read()
+    writer.close()
+
+
+async def spooled_monitor(reader, writer, spool):
+    _, options = parse_command(str(await reader.readline(), 'utf-8'))
+    offset = spool.resume_offset(int(options['resume']) if 'resume' in options else None)
+    writer.write(encode_hello(name='spooled', parser='pcap', offset=offset))
+    while True:
+        start, data, _ = spool.read(offset, 1 << 20, timeout=0)
+        if not data:
+            break
+        writer.write(data)
+        offset = start + len(data)
+    await writer.drain()
+    while True:
+        command, options = parse_command(str(await reader.readline(), 'utf-8') or 'closed')
+        if command == 'closed':
+            break
+        if command == 'ack':
+            spool.acknowledge(int(options['offset']))
+    writer.close()
+
+
+class RecordingDataBase:
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.extend(data)
+
+
+def test_legacy_epochs_are_converted_to_nanoseconds():
+    device = CaptureDevice('legacy', 'localhost', 0)
+    device.protocol = 1
+    epoch = 1700000000123456789
+    data = json.dumps(dict(records('legacy', [0])[0], epoch=epoch / 1e9 * 10e9)).encode()
+    decoded = device.decode(data[:20]) + device.decode(data[20:])
+    assert len(decoded) == 1
+    assert abs(decoded[0]['epoch'] - epoch) < 1000
+
+
+def test_mixed_swarm_merges_legacy_and_framed_nodes_in_order():
+    now = time.time_ns()
+    legacy_epochs = [now + i * SECOND // 10 for i in range(0, 50, 2)]
+    framed_epochs = [now + i * SECOND // 10 for i in range(1, 50, 2)]
+    consumed = []
+
+    async def run():
+        legacy = await asyncio.start_server(lambda r, w: legacy_monitor(r, w, legacy_epochs), '127.0.0.1', 0)
+        framed = await asyncio.start_server(lambda r, w: framed_monitor(r, w, framed_epochs), '127.0.0.1', 0)
+        swarm = Swarm()
+        swarm.database = RecordingDataBase()
+        swarm.allowed_lateness_in_s = 1
+        for name, server in (('legacy', legacy), ('framed', framed)):
+            device = CaptureDevice(name, '127.0.0.1', server.sockets[0].getsockname()[1])
+            device.initial_backoff_in_s = 0.01
+            swarm.add_device(device)
+        await swarm.start_tasks(consumed.extend)
+        await asyncio.sleep(1.5)
+        assert swarm.late_window == []
+        await swarm.stop_tasks()
+        legacy.close()
+        framed.close()
+        return swarm
+
+    swarm = asyncio.run(run())
+    assert swarm.database.written == consumed
+    assert [record['ap'] for record in consumed] == ['legacy', 'framed'] * 25
+    epochs = [record['epoch'] for record in consumed]
+    assert epochs == sorted(epochs)
+    assert all(abs(epoch - expected) < SECOND // 100 for epoch, expected in zip(epochs, sorted(legacy_epochs + framed_epochs)))
+
+
+def test_spool_is_acknowledged_only_for_records_written_to_the_database(tmp_path):
+    now = time.time_ns()
+    epochs = [now + i * SECOND // 10 for i in range(20)]
+    spool = Spool(tmp_path)
+    for first in range(0, len(epochs), 5):
+        spool.append(encode_batch(records('spooled', epochs[first:first + 5])))
+
+    async def connect(run):
+        server = await asyncio.start_server(lambda r, w: spooled_monitor(r, w, spool), '127.0.0.1', 0)
+        swarm = Swarm()
+        swarm.database = RecordingDataBase()
+        swarm.window_in_s = 60
+        device = CaptureDevice('spooled', '127.0.0.1', server.sockets[0].getsockname()[1])
+        device.connect_timeout_in_s = 0.1
+        swarm.add_device(device)
+        consumed = []
+        await swarm.start_tasks(consumed.extend)
+        await asyncio.sleep(0.5)
+        assert len(consumed) == len(epochs)
+        await run(swarm)
+        server.close()
+        return swarm.database.written
+
+    async def crash(swarm):
+        for task in swarm.tasks:
+            task.cancel()
+        await asyncio.gather(*swarm.tasks, return_exceptions=True)
+
+    async def write_and_stop(swarm):
+        await swarm.write_window()
+        await asyncio.sleep(0.2)
+        assert spool.acked == spool.end
+        await swarm.stop_tasks()
+
+    assert asyncio.run(connect(crash)) == []
+    assert spool.acked == 0
+    written = asyncio.run(connect(write_and_stop))
+    assert len(written) == len(epochs)
+    assert len({record['epoch'] - epoch for record, epoch in zip(written, epochs)}) == 1
+
+
+class RecordingWriter:
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(str(data, 'utf-8'))
+
+
+def test_nodes_with_skewed_clocks_hop_in_phase():
+    schedule = ChannelSchedule([1, 6, 11], [0.1, 0.15, 0.25], start=1700000000.0)
+    devices = []
+    for clock_offset_in_ms in (0, 180, -420):
+        device = CaptureDevice('node', '127.0.0.1', 0)
+        device.clock_offset_in_ms = clock_offset_in_ms
+        device.writer, device.hello_received = RecordingWriter(), True
+        device.send_schedule(schedule)
+        _, options = parse_command(device.writer.lines[-1])
+        devices.append((device, ChannelSchedule.from_options(options)))
+    for step in range(50):
+        now = schedule.start + 3600 + step * 0.037
+        # a node's own clock reads the sync's time minus its clock offset
+        slots = [received.slot_at(now - device.clock_offset() / 1e9)[0] for device, received in devices]
+        assert slots == [schedule.slot_at(now)[0]] * len(devices)